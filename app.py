@@ -1,12 +1,24 @@
 from flask import Flask, jsonify, render_template, request, redirect, url_for, session, flash
+from flask import g, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date, timezone
+from flask_sqlalchemy.session import Session as SessaoFlask
+from datetime import datetime, date, timedelta, timezone
 from collections import defaultdict
 from collections import OrderedDict
-from sqlalchemy import extract, func
-from flask_migrate import Migrate
+from sqlalchemy import case, extract, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
+from flask_migrate import Migrate, upgrade
+from functools import wraps
+from markupsafe import Markup
 from zoneinfo import ZoneInfo
+import click
+import json
 import os
+import threading
+import time
 
 # ---------------------
 # CONFIGURAÇÕES
@@ -19,19 +31,47 @@ app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "chave_secreta_super_secreta"
 # Configuração do banco: pega a URL do Railway
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
 
+# Réplica opcional, só para leitura (relatórios e dashboard)
+if os.getenv("DATABASE_REPLICA_URL"):
+    app.config['SQLALCHEMY_BINDS'] = {"replica": os.getenv("DATABASE_REPLICA_URL")}
+
+# Segundos após uma escrita em que o mesmo usuário continua lendo do primário
+app.config['REPLICA_ATRASO_MAX'] = float(os.getenv("REPLICA_ATRASO_MAX", 5))
+
+# Intervalo entre verificações de disponibilidade da réplica
+app.config['REPLICA_VERIFICACAO'] = 30
+
+# Quantidade máxima de trechos de HTML guardados no cache de fragmentos
+app.config['CACHE_FRAGMENTOS_MAX'] = int(os.getenv("CACHE_FRAGMENTOS_MAX", 256))
+
 # Desativa rastreamento extra
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# No SQLite, espera até 15s por um escritor concorrente antes de falhar com "database is locked"
+if (os.getenv("DATABASE_URL") or "").startswith("sqlite"):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {"connect_args": {"timeout": 15}}
+
+
+class SessaoRoteada(SessaoFlask):
+    """Sessão que envia para a réplica as leituras das rotas marcadas com @somente_leitura."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and has_app_context()
+            and g.get("usar_replica")
+        ):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
 # Cria a instância do banco UMA vez
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={"class_": SessaoRoteada})
 
-# Configura migrations
+# Configura migrations (o esquema é criado/atualizado com "flask db upgrade")
 migrate = Migrate(app, db)
 
-# Se quiser criar tabelas automaticamente
-with app.app_context():
-    db.create_all()
-
 # ---------------------
 # MODELOS
 # ---------------------
@@ -59,19 +99,50 @@ class Item(db.Model):
 
 
 class Venda(db.Model):
+    __table_args__ = (
+        # filtra pelo dia e agrupa pela hora; o prefixo também serve às buscas só por data_local
+        db.Index("ix_venda_data_local_hora_local", "data_local", "hora_local"),
+        # ids nunca reaproveitados: vendas arquivadas mantêm o id original
+        {"sqlite_autoincrement": True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     forma_pagamento = db.Column(db.String(50), nullable=False)
-    data_venda = db.Column(db.DateTime, default=datetime.now)
+    # sempre em UTC; preenchido por preencher_data_local quando não informado
+    data_venda = db.Column(db.DateTime)
+    # dia e hora de Brasília, calculados na gravação para filtrar/agrupar pelo índice
+    data_local = db.Column(db.Date)
+    hora_local = db.Column(db.Integer)
     valor_total = db.Column(db.Float, nullable=False)
     lucro_total = db.Column(db.Float, nullable=False)
     conferido = db.Column(db.Boolean, default=False, nullable=False)
+    # chave gerada pelo terminal para que reenvios do lote não dupliquem a venda
+    chave_idempotencia = db.Column(db.String(64), unique=True)
+    # controle otimista: todo UPDATE/DELETE confere e incrementa a versão
+    versao = db.Column(db.Integer, nullable=False, default=1, server_default="1")
     itens = db.relationship("VendaItem", backref="venda", cascade="all, delete-orphan")
 
+    __mapper_args__ = {"version_id_col": versao}
+
+    # vendas de anos arquivados só são exibidas, não editadas
+    arquivada = False
+
+    @property
+    def data_venda_br(self):
+        return data_venda_local(self.data_venda)
+
 
 class VendaItem(db.Model):
+    # ids nunca reaproveitados: a análise de itens usa o id como marcador
+    __table_args__ = {"sqlite_autoincrement": True}
+    # uma edição concorrente pode ter recriado os itens; quem protege a
+    # operação é a checagem de versão da venda
+    __mapper_args__ = {"confirm_deleted_rows": False}
+
     id = db.Column(db.Integer, primary_key=True)
     venda_id = db.Column(db.Integer, db.ForeignKey("venda.id"), nullable=False)
-    item_id = db.Column(db.Integer, db.ForeignKey("item.id"), nullable=False)
+    # indexado: a análise refaz primeira/última venda de um item após cancelamentos
+    item_id = db.Column(db.Integer, db.ForeignKey("item.id"), nullable=False, index=True)
     item = db.relationship("Item")
     quantidade = db.Column(db.Integer, nullable=False, default=1)
     valor_venda = db.Column(db.Float, nullable=False)
@@ -88,61 +159,1148 @@ class Despesa(db.Model):
     categoria = db.Column(db.String(50), nullable=False)
 
 
+class VendaArquivo(db.Model):
+    """Venda de um ano fechado, movida pelo comando ``flask archive``."""
+    id = db.Column(db.Integer, primary_key=True)
+    forma_pagamento = db.Column(db.String(50), nullable=False)
+    data_venda = db.Column(db.DateTime)
+    data_local = db.Column(db.Date, index=True)
+    hora_local = db.Column(db.Integer)
+    valor_total = db.Column(db.Float, nullable=False)
+    lucro_total = db.Column(db.Float, nullable=False)
+    conferido = db.Column(db.Boolean, default=False, nullable=False)
+    # continua única depois de arquivada: reenvios do lote consultam as duas tabelas
+    chave_idempotencia = db.Column(db.String(64), unique=True)
+    itens = db.relationship("VendaItemArquivo", backref="venda")
+
+    arquivada = True
+
+    @property
+    def data_venda_br(self):
+        return data_venda_local(self.data_venda)
+
+
+class VendaItemArquivo(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    venda_id = db.Column(db.Integer, db.ForeignKey("venda_arquivo.id"), nullable=False, index=True)
+    item_id = db.Column(db.Integer, db.ForeignKey("item.id"), nullable=False)
+    item = db.relationship("Item")
+    quantidade = db.Column(db.Integer, nullable=False, default=1)
+    valor_venda = db.Column(db.Float, nullable=False)
+    desconto = db.Column(db.Float, default=0)
+    acrescimo = db.Column(db.Float, default=0)
+    lucro = db.Column(db.Float, nullable=False)
+
+
+class ResumoArquivo(db.Model):
+    """Totais diários por forma de pagamento das vendas arquivadas."""
+    data = db.Column(db.Date, primary_key=True)
+    forma_pagamento = db.Column(db.String(50), primary_key=True)
+    quantidade_vendas = db.Column(db.Integer, nullable=False)
+    valor_total = db.Column(db.Float, nullable=False)
+    lucro_total = db.Column(db.Float, nullable=False)
+
+
+TZ_BR = ZoneInfo("America/Sao_Paulo")
+
+
+def em_utc(valor):
+    """Datetime gravado em UTC (o banco devolve sem fuso) como datetime com fuso UTC."""
+    if valor is None:
+        return None
+    if valor.tzinfo is None:
+        return valor.replace(tzinfo=timezone.utc)
+    return valor.astimezone(timezone.utc)
+
+
+def data_venda_local(data_venda):
+    """Converte data_venda (gravada em UTC) para o horário de Brasília."""
+    if data_venda is None:
+        return None
+    return em_utc(data_venda).astimezone(TZ_BR)
+
+
+@db.event.listens_for(Venda, "before_insert")
+@db.event.listens_for(Venda, "before_update")
+def preencher_data_local(mapper, connection, venda):
+    if venda.data_venda is None:
+        venda.data_venda = datetime.now(timezone.utc)
+    local = data_venda_local(venda.data_venda)
+    venda.data_local = local.date()
+    venda.hora_local = local.hour
+
+
+class Marcador(db.Model):
+    """Valores de controle interno (ex.: último VendaItem já processado)."""
+    chave = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ItemAnalise(db.Model):
+    """Totais realizados por item, atualizados incrementalmente a partir de VendaItem."""
+    item_id = db.Column(db.Integer, db.ForeignKey("item.id"), primary_key=True)
+    item = db.relationship(
+        "Item",
+        backref=db.backref("analise", uselist=False, cascade="all, delete-orphan")
+    )
+    linhas = db.Column(db.Integer, nullable=False, default=0)
+    quantidade = db.Column(db.Float, nullable=False, default=0)
+    receita = db.Column(db.Float, nullable=False, default=0)
+    desconto = db.Column(db.Float, nullable=False, default=0)
+    acrescimo = db.Column(db.Float, nullable=False, default=0)
+    lucro = db.Column(db.Float, nullable=False, default=0)
+    primeira_venda = db.Column(db.DateTime)
+    ultima_venda = db.Column(db.DateTime)
+    classe_abc = db.Column(db.String(1), nullable=False, default="C")
+    participacao_acumulada = db.Column(db.Float, nullable=False, default=0)
+
+
+class Alteracao(db.Model):
+    """Insert/update/delete de vendas, itens e despesas, gravado na mesma transação (outbox).
+
+    Consumidores leem em ordem de ``sequencia`` a partir da última que já processaram.
+    """
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    # ordem de commit (o id é reservado no flush e pode chegar ao banco fora de ordem);
+    # é o cursor de /changes
+    sequencia = db.Column(db.Integer, unique=True)
+    tabela = db.Column(db.String(30), nullable=False)
+    registro_id = db.Column(db.Integer, nullable=False)
+    operacao = db.Column(db.String(6), nullable=False)
+    # valores das colunas depois da alteração (no delete, os últimos conhecidos)
+    dados = db.Column(db.JSON)
+    criado_em = db.Column(db.DateTime, nullable=False, index=True)
+
+
+# ---------------------
+# FUNÇÕES AUXILIARES
+# ---------------------
+_estado_replica = {"disponivel": True, "verificado_em": None}
+
+
+def replica_disponivel():
+    """Verifica a réplica no máximo a cada REPLICA_VERIFICACAO segundos."""
+    if "replica" not in db.engines:
+        return False
+
+    agora = time.monotonic()
+    verificado_em = _estado_replica["verificado_em"]
+    if verificado_em is None or agora - verificado_em >= app.config["REPLICA_VERIFICACAO"]:
+        try:
+            with db.engines["replica"].connect() as conexao:
+                conexao.execute(db.text("SELECT 1"))
+            _estado_replica["disponivel"] = True
+        except SQLAlchemyError:
+            _estado_replica["disponivel"] = False
+        _estado_replica["verificado_em"] = agora
+
+    return _estado_replica["disponivel"]
+
+
+def somente_leitura(view):
+    """Marca uma rota que só consulta o banco para ler da réplica, se houver.
+
+    Fica no primário quando não há réplica, quando ela está fora do ar ou
+    quando o usuário gravou algo há menos de REPLICA_ATRASO_MAX segundos
+    (para ver a própria escrita). Se a réplica falhar no meio da requisição,
+    a rota é executada de novo no primário.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        recente = time.time() - session.get("ultima_escrita", 0) < app.config["REPLICA_ATRASO_MAX"]
+        if recente or not replica_disponivel():
+            return view(*args, **kwargs)
+
+        g.usar_replica = True
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            db.session.rollback()
+            _estado_replica.update(disponivel=False, verificado_em=time.monotonic())
+            app.logger.warning("Réplica indisponível, lendo do primário.", exc_info=True)
+            g.usar_replica = False
+            return view(*args, **kwargs)
+        finally:
+            g.usar_replica = False
+
+    return wrapper
+
+
+@db.event.listens_for(SessaoRoteada, "after_flush")
+def _marcar_escrita(sessao, contexto):
+    if has_request_context():
+        g.houve_escrita = True
+
+
+@app.after_request
+def _registrar_escrita(resposta):
+    # leituras seguintes do mesmo usuário ficam no primário por alguns segundos
+    if g.get("houve_escrita"):
+        session["ultima_escrita"] = time.time()
+    return resposta
+
+
+def _valor_json(valor):
+    # datetimes sempre em UTC com o offset explícito: o objeto da sessão (insert)
+    # tem fuso, mas o que volta do banco (update, RETURNING dos lotes) não
+    if isinstance(valor, datetime):
+        return em_utc(valor).isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def _linha_alteracao(tabela, operacao, dados):
+    return {
+        "tabela": tabela,
+        "registro_id": dados["id"],
+        "operacao": operacao,
+        "dados": {chave: _valor_json(valor) for chave, valor in dados.items()},
+        "criado_em": datetime.now(timezone.utc).replace(tzinfo=None)
+    }
+
+
+def _ouvinte_alteracao(operacao):
+    """Guarda a alteração na sessão; ela é gravada no fim do flush, num único INSERT."""
+    def ouvinte(mapper, connection, obj):
+        estado = db.inspect(obj)
+        colunas = mapper.column_attrs
+        if operacao == "update" and not any(
+            estado.attrs[c.key].history.has_changes() for c in colunas
+        ):
+            return
+        # estado.dict não dispara SELECT (no delete a linha já não existe)
+        estado.session.info.setdefault("alteracoes", []).append(_linha_alteracao(
+            mapper.local_table.name,
+            operacao,
+            {c.key: estado.dict.get(c.key) for c in colunas}
+        ))
+    return ouvinte
+
+
+for _modelo in (Venda, VendaItem, Item, Despesa):
+    for _operacao in ("insert", "update", "delete"):
+        db.event.listen(_modelo, f"after_{_operacao}", _ouvinte_alteracao(_operacao))
+
+
+def _inserir_alteracoes(sessao, alteracoes):
+    """Grava as alterações sem sequência; ela é atribuída no commit."""
+    ids = sessao.connection().execute(
+        Alteracao.__table__.insert().returning(Alteracao.__table__.c.id),
+        alteracoes
+    ).scalars().all()
+    sessao.info.setdefault("alteracoes_ids", []).extend(ids)
+
+
+@db.event.listens_for(SessaoRoteada, "after_flush")
+def _gravar_alteracoes(sessao, contexto):
+    alteracoes = sessao.info.pop("alteracoes", None)
+    if alteracoes:
+        _inserir_alteracoes(sessao, alteracoes)
+
+
+@db.event.listens_for(SessaoRoteada, "before_commit")
+def _sequenciar_alteracoes(sessao):
+    """Numera as alterações da transação na ordem em que os commits acontecem.
+
+    O contador fica numa linha de Marcador cuja trava só é liberada pelo
+    commit: quem pegou números menores já fez commit antes que outra
+    transação consiga pegar os seguintes, então o cursor nunca passa por
+    cima de uma alteração que ainda vai aparecer.
+    """
+    # o commit só faz o flush final depois deste evento
+    sessao.flush()
+    ids = sessao.info.pop("alteracoes_ids", None)
+    if not ids:
+        return
+
+    conexao = sessao.connection()
+    insert = _INSERT_COM_CONFLITO[conexao.dialect.name]
+    ultima = conexao.execute(
+        insert(Marcador.__table__)
+        .values(chave="alteracoes_sequencia", valor=len(ids))
+        .on_conflict_do_update(
+            index_elements=[Marcador.__table__.c.chave],
+            set_={"valor": Marcador.__table__.c.valor + len(ids)}
+        )
+        .returning(Marcador.__table__.c.valor)
+    ).scalar_one()
+
+    tabela = Alteracao.__table__
+    conexao.execute(
+        tabela.update()
+        .where(tabela.c.id == db.bindparam("b_id"))
+        .values(sequencia=db.bindparam("b_sequencia")),
+        [
+            {"b_id": id_, "b_sequencia": ultima - len(ids) + n}
+            for n, id_ in enumerate(sorted(ids), start=1)
+        ]
+    )
+
+
+@db.event.listens_for(SessaoRoteada, "after_soft_rollback")
+def _descartar_alteracoes(sessao, transacao):
+    sessao.info.pop("alteracoes", None)
+    sessao.info.pop("alteracoes_ids", None)
+
+
+def registrar_alteracoes(tabela, operacao, linhas):
+    """Registra alterações feitas por UPDATE/DELETE em massa, que não passam pelo flush."""
+    if linhas:
+        _inserir_alteracoes(
+            db.session(),
+            [_linha_alteracao(tabela, operacao, dict(linha)) for linha in linhas]
+        )
+
+
+def listar_alteracoes(desde=0, limite=500, tabela=None):
+    """Alterações com sequência maior que ``desde``, em ordem, já em formato JSON."""
+    consulta = Alteracao.query.filter(Alteracao.sequencia > desde)
+    if tabela:
+        consulta = consulta.filter(Alteracao.tabela == tabela)
+
+    return [
+        {
+            "sequencia": a.sequencia,
+            "id": a.id,
+            "tabela": a.tabela,
+            "registro_id": a.registro_id,
+            "operacao": a.operacao,
+            "dados": a.dados,
+            "criado_em": a.criado_em.isoformat()
+        }
+        for a in consulta.order_by(Alteracao.sequencia.asc()).limit(limite)
+    ]
+
+
+class CacheFragmentos:
+    """Cache LRU em memória de trechos de HTML já renderizados.
+
+    As chaves carregam a versão dos dados (guardada em Marcador), então uma
+    escrita em qualquer worker torna as entradas antigas inalcançáveis; elas
+    saem pelo LRU ou por ``descartar`` no worker que fez a escrita.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave):
+        with self._trava:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._itens[chave]
+            self.falhas += 1
+            return None
+
+    def guardar(self, chave, html):
+        with self._trava:
+            self._itens[chave] = html
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def descartar(self, nome):
+        """Remove as entradas de um grupo (primeiro elemento da chave)."""
+        with self._trava:
+            for chave in [c for c in self._itens if c[0] == nome]:
+                del self._itens[chave]
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+
+
+cache_fragmentos = CacheFragmentos(app.config["CACHE_FRAGMENTOS_MAX"])
+
+
+def versoes_cache(*nomes):
+    """Versões atuais dos grupos de cache, lidas em uma consulta."""
+    chaves = {f"cache:{nome}": nome for nome in nomes}
+    encontrados = dict(
+        db.session.query(Marcador.chave, Marcador.valor)
+        .filter(Marcador.chave.in_(chaves))
+        .all()
+    )
+    return {nome: encontrados.get(chave, 0) for chave, nome in chaves.items()}
+
+
+# INSERT ... ON CONFLICT por banco; os dois usados aqui suportam
+_INSERT_COM_CONFLITO = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def invalidar_cache(*nomes):
+    """Incrementa a versão dos grupos na transação atual (commit fica com quem chamou).
+
+    Usa upsert: duas transações gravando a primeira venda do dia criariam o
+    mesmo marcador e uma delas falharia no commit. Os grupos vão em ordem para
+    que lotes que tocam vários dias travem as linhas sempre na mesma sequência.
+    """
+    insert = _INSERT_COM_CONFLITO[db.session.get_bind().dialect.name]
+    for nome in sorted(set(nomes)):
+        db.session.execute(
+            insert(Marcador)
+            .values(chave=f"cache:{nome}", valor=1)
+            .on_conflict_do_update(
+                index_elements=[Marcador.chave],
+                set_={"valor": Marcador.valor + 1}
+            )
+        )
+        cache_fragmentos.descartar(nome)
+
+
+def fragmento(chave, template, contexto):
+    """Devolve o HTML de ``template`` do cache ou renderiza com ``contexto()``."""
+    html = cache_fragmentos.obter(chave)
+    if html is None:
+        html = Markup(render_template(template, **contexto()))
+        cache_fragmentos.guardar(chave, html)
+    return html
+
+
+def cache_dia(dia):
+    return f"vendas:{dia.isoformat()}"
+
+
+def cache_da_venda(venda):
+    """Grupo de cache do dia da venda (vendas antigas podem estar sem data_local)."""
+    return cache_dia(venda.data_local or data_venda_local(venda.data_venda).date())
+
+
+class ConflitoVenda(Exception):
+    """A venda foi alterada em outro terminal depois de ser carregada."""
+
+
+# Códigos do PostgreSQL para serialização, deadlock e lock indisponível
+CODIGOS_BLOQUEIO = {"40001", "40P01", "55P03"}
+
+
+def _erro_de_bloqueio(erro):
+    origem = getattr(erro, "orig", None)
+    return (
+        "database is locked" in str(origem)
+        or getattr(origem, "pgcode", None) in CODIGOS_BLOQUEIO
+    )
+
+
+def executar_escrita(gravar, tentativas=3, espera=0.05):
+    """Executa ``gravar`` (que altera e faz commit), repetindo se o banco estiver bloqueado.
+
+    ``gravar`` deve recarregar o que precisa, pois cada tentativa começa após
+    um rollback. Conflitos de versão viram ConflitoVenda, sem nova tentativa.
+    """
+    for tentativa in range(1, tentativas + 1):
+        try:
+            return gravar()
+        except (StaleDataError, ConflitoVenda):
+            db.session.rollback()
+            raise ConflitoVenda()
+        except OperationalError as erro:
+            db.session.rollback()
+            if tentativa == tentativas or not _erro_de_bloqueio(erro):
+                raise
+            time.sleep(espera * 2 ** (tentativa - 1))
+
+
+def calcular_linha_venda(item, quantidade=None, valor=None, desconto=0, acrescimo=0):
+    """Calcula quantidade, valor e lucro de uma linha de venda.
+
+    Segue a regra do carrinho: a quantidade informada tem prioridade; sem ela,
+    o valor informado define a quantidade; sem nenhum dos dois, vende 1 unidade.
+    """
+    preco_unitario = item.preco_venda
+
+    if quantidade is not None:
+        valor_venda = (preco_unitario * quantidade) - desconto + acrescimo
+    elif valor is not None:
+        quantidade = valor / preco_unitario
+        valor_venda = valor - desconto + acrescimo
+    else:
+        quantidade = 1
+        valor_venda = preco_unitario - desconto + acrescimo
+
+    lucro = (preco_unitario - item.preco_compra) * quantidade - desconto + acrescimo
+    return quantidade, valor_venda, lucro
+
+
+# Faixas da curva ABC: itens que somam até 80% da receita são A, até 95% são B
+CURVA_ABC = (("A", 80.0), ("B", 95.0))
+
+
+def _classificar_abc():
+    """Recalcula a curva ABC sobre a tabela de análise (O(itens))."""
+    analises = ItemAnalise.query.order_by(ItemAnalise.receita.desc()).all()
+    receita_total = sum(max(a.receita, 0) for a in analises)
+
+    acumulado = 0
+    for a in analises:
+        receita = max(a.receita, 0)
+        # o item que cruza o limite ainda pertence à faixa
+        anterior = (acumulado / receita_total * 100) if receita_total > 0 else 100
+        acumulado += receita
+        a.participacao_acumulada = (acumulado / receita_total * 100) if receita_total > 0 else 0
+        a.classe_abc = "C"
+        if receita > 0:
+            for classe, limite in CURVA_ABC:
+                if anterior < limite:
+                    a.classe_abc = classe
+                    break
+
+
+def _travar_marcador_analise():
+    """Lê o marcador da análise com FOR UPDATE.
+
+    Toda escrita em ItemAnalise passa por aqui primeiro, então atualização e
+    cancelamentos se alternam em vez de se sobrescreverem.
+    """
+    return (
+        Marcador.query
+        .filter_by(chave="analise_itens")
+        .with_for_update()
+        .one_or_none()
+    )
+
+
+def _abc_pendente(pendente):
+    """Liga/desliga o aviso de que a curva ABC precisa ser refeita após um cancelamento."""
+    insert = _INSERT_COM_CONFLITO[db.session.get_bind().dialect.name]
+    db.session.execute(
+        insert(Marcador)
+        .values(chave="analise_itens_abc", valor=int(pendente))
+        .on_conflict_do_update(index_elements=[Marcador.chave], set_={"valor": int(pendente)})
+    )
+
+
+def analise_desatualizada():
+    """Sem travas: há linhas novas ou cancelamentos ainda fora da análise?"""
+    marcadores = dict(
+        db.session.query(Marcador.chave, Marcador.valor)
+        .filter(Marcador.chave.in_(["analise_itens", "analise_itens_abc"]))
+        .all()
+    )
+    maior_id = db.session.query(func.max(VendaItem.id)).scalar() or 0
+    return maior_id > marcadores.get("analise_itens", 0) or bool(marcadores.get("analise_itens_abc"))
+
+
+def atualizar_analise_itens(completo=False):
+    """Soma na tabela de análise apenas os VendaItem novos desde a última execução.
+
+    Com ``completo=True`` a tabela é reconstruída do zero. Retorna a quantidade
+    de itens do catálogo afetados.
+    """
+    marcador = _travar_marcador_analise()
+    if marcador is None:
+        marcador = Marcador(chave="analise_itens", valor=0)
+        db.session.add(marcador)
+        db.session.flush()
+    valor_lido = marcador.valor
+
+    if completo:
+        ItemAnalise.query.delete()
+        ultimo_processado = 0
+        # a reconstrução também soma as vendas já arquivadas
+        fontes = fontes_vendas()
+    else:
+        ultimo_processado = valor_lido
+        fontes = [(Venda, VendaItem)]
+
+    novos = []
+    for modelo_venda, modelo_item in fontes:
+        novos += (
+            db.session.query(
+                modelo_item.item_id,
+                func.count(modelo_item.id),
+                func.sum(modelo_item.quantidade),
+                func.sum(modelo_item.valor_venda),
+                func.sum(func.coalesce(modelo_item.desconto, 0)),
+                func.sum(func.coalesce(modelo_item.acrescimo, 0)),
+                func.sum(modelo_item.lucro),
+                func.min(modelo_venda.data_venda),
+                func.max(modelo_venda.data_venda),
+                func.max(modelo_item.id)
+            )
+            .join(modelo_venda, modelo_venda.id == modelo_item.venda_id)
+            .filter(modelo_item.id > ultimo_processado)
+            .group_by(modelo_item.item_id)
+            .all()
+        )
+
+    if not novos and not completo:
+        # cancelamentos só descontam valores; a curva ABC é refeita aqui
+        pendente = db.session.get(Marcador, "analise_itens_abc")
+        if pendente is not None and pendente.valor:
+            _classificar_abc()
+            _abc_pendente(False)
+        db.session.commit()
+        return 0
+
+    existentes = {
+        a.item_id: a
+        for a in ItemAnalise.query.filter(ItemAnalise.item_id.in_([n[0] for n in novos]))
+    }
+
+    novo_marcador = ultimo_processado
+    for item_id, linhas, qtd, receita, desconto, acrescimo, lucro, primeira, ultima, maior_id in novos:
+        a = existentes.get(item_id)
+        if a is None:
+            a = ItemAnalise(
+                item_id=item_id, linhas=linhas, quantidade=qtd or 0, receita=receita or 0,
+                desconto=desconto or 0, acrescimo=acrescimo or 0, lucro=lucro or 0,
+                primeira_venda=primeira, ultima_venda=ultima
+            )
+            db.session.add(a)
+            # o mesmo item pode vir de novo da outra fonte; o UPDATE abaixo precisa da linha
+            db.session.flush()
+            existentes[item_id] = a
+        else:
+            # soma relativa no banco, como o desconto feito por remover_da_analise
+            ItemAnalise.query.filter_by(item_id=item_id).update({
+                "linhas": ItemAnalise.linhas + linhas,
+                "quantidade": ItemAnalise.quantidade + (qtd or 0),
+                "receita": ItemAnalise.receita + (receita or 0),
+                "desconto": ItemAnalise.desconto + (desconto or 0),
+                "acrescimo": ItemAnalise.acrescimo + (acrescimo or 0),
+                "lucro": ItemAnalise.lucro + (lucro or 0),
+                "primeira_venda": min(filter(None, [a.primeira_venda, primeira]), default=None),
+                "ultima_venda": max(filter(None, [a.ultima_venda, ultima]), default=None)
+            }, synchronize_session=False)
+        novo_marcador = max(novo_marcador, maior_id)
+
+    for a in existentes.values():
+        db.session.expire(a)
+    _classificar_abc()
+    _abc_pendente(False)
+
+    # só avança o marcador se ninguém o avançou enquanto somávamos;
+    # caso contrário descarta esta rodada para não contar linhas duas vezes
+    avancou = (
+        Marcador.query
+        .filter_by(chave="analise_itens", valor=valor_lido)
+        .update({"valor": novo_marcador})
+    )
+    if not avancou:
+        db.session.rollback()
+        return 0
+
+    db.session.commit()
+    return len(existentes)
+
+
+def remover_da_analise(venda_itens):
+    """Desconta da análise linhas de venda que vão ser apagadas ou reescritas.
+
+    A curva ABC não é refeita aqui (isso reescreveria a análise do catálogo
+    inteiro dentro da transação da venda); fica para a próxima atualização.
+    """
+    # espera uma atualização em andamento terminar: uma linha que ela já
+    # somou só conta como processada depois que o marcador dela for gravado
+    marcador = _travar_marcador_analise()
+    if marcador is None:
+        return
+
+    somadas = [vi for vi in venda_itens if vi.id is not None and vi.id <= marcador.valor]
+    if not somadas:
+        return
+    # mesma trava do marcador acima, então não cria espera nova
+    _abc_pendente(True)
+
+    # só uma venda na ponta muda a primeira/última venda do item
+    pontas = {
+        a.item_id: {em_utc(a.primeira_venda), em_utc(a.ultima_venda)}
+        for a in ItemAnalise.query.filter(ItemAnalise.item_id.in_({vi.item_id for vi in somadas}))
+    }
+    refazer_datas = {
+        vi.item_id for vi in somadas
+        if em_utc(vi.venda.data_venda) in pontas.get(vi.item_id, ())
+    }
+
+    for vi in somadas:
+        ItemAnalise.query.filter_by(item_id=vi.item_id).update({
+            "linhas": ItemAnalise.linhas - 1,
+            "quantidade": ItemAnalise.quantidade - (vi.quantidade or 0),
+            "receita": ItemAnalise.receita - (vi.valor_venda or 0),
+            "desconto": ItemAnalise.desconto - (vi.desconto or 0),
+            "acrescimo": ItemAnalise.acrescimo - (vi.acrescimo or 0),
+            "lucro": ItemAnalise.lucro - (vi.lucro or 0)
+        }, synchronize_session=False)
+
+    if refazer_datas:
+        _refazer_datas_analise(refazer_datas, marcador.valor, {vi.id for vi in somadas})
+
+
+def _refazer_datas_analise(item_ids, ultimo_processado, ignorar):
+    """Recalcula primeira/última venda dos itens a partir das linhas já somadas que ficam."""
+    datas = {item_id: (None, None) for item_id in item_ids}
+    for modelo_venda, modelo_item in fontes_vendas():
+        for item_id, primeira, ultima in (
+            db.session.query(
+                modelo_item.item_id,
+                func.min(modelo_venda.data_venda),
+                func.max(modelo_venda.data_venda)
+            )
+            .join(modelo_venda, modelo_venda.id == modelo_item.venda_id)
+            .filter(
+                modelo_item.item_id.in_(item_ids),
+                modelo_item.id <= ultimo_processado,
+                modelo_item.id.not_in(ignorar)
+            )
+            .group_by(modelo_item.item_id)
+        ):
+            antes = datas[item_id]
+            datas[item_id] = (
+                min(filter(None, [antes[0], primeira]), default=None),
+                max(filter(None, [antes[1], ultima]), default=None)
+            )
+
+    for item_id, (primeira, ultima) in datas.items():
+        ItemAnalise.query.filter_by(item_id=item_id).update(
+            {"primeira_venda": primeira, "ultima_venda": ultima},
+            synchronize_session=False
+        )
+
+
+def _analise_json(a, hoje):
+    """Indicadores derivados de uma linha de ItemAnalise."""
+    bruto = a.receita + a.desconto - a.acrescimo
+    # mesma base de Item.margem_lucro (sobre o custo), para as duas serem comparáveis
+    custo = a.receita - a.lucro
+    dias = 1
+    if a.primeira_venda:
+        dias = max((hoje - data_venda_local(a.primeira_venda).date()).days + 1, 1)
+    return {
+        "item_id": a.item_id,
+        "item": a.item.nome,
+        "categoria": a.item.categoria.nome if a.item.categoria else None,
+        "quantidade": round(a.quantidade, 2),
+        "receita": round(a.receita, 2),
+        "lucro": round(a.lucro, 2),
+        "margem_cadastrada": round(a.item.margem_lucro or 0, 2),
+        "margem_realizada": round(a.lucro / custo * 100, 2) if custo else 0,
+        "taxa_desconto": round(a.desconto / bruto * 100, 2) if bruto else 0,
+        "velocidade_diaria": round(a.quantidade / dias, 2),
+        "classe_abc": a.classe_abc,
+        "participacao_acumulada": round(a.participacao_acumulada, 2),
+        "ultima_venda": data_venda_local(a.ultima_venda).strftime("%d/%m/%Y") if a.ultima_venda else None
+    }
+
+
+def listar_analise_itens():
+    """Atualiza se houver algo pendente e devolve a análise ordenada por receita.
+
+    Sem vendas novas nem cancelamentos, é só leitura: não pega a trava do
+    marcador nem grava nada.
+    """
+    if analise_desatualizada():
+        atualizar_analise_itens()
+    hoje = datetime.now(TZ_BR).date()
+    analises = (
+        ItemAnalise.query
+        .options(db.joinedload(ItemAnalise.item).joinedload(Item.categoria))
+        .order_by(ItemAnalise.receita.desc())
+        .all()
+    )
+    return [_analise_json(a, hoje) for a in analises]
+
+
+@app.cli.command("analise-itens")
+@click.option("--completo", is_flag=True, help="Reconstrói a análise a partir de todas as vendas.")
+def analise_itens_comando(completo):
+    """Atualiza a tabela de análise de itens (margem realizada e curva ABC)."""
+    afetados = atualizar_analise_itens(completo=completo)
+    click.echo(f"{afetados} itens atualizados.")
+
+
+def preencher_data_local_pendentes(lote=1000):
+    """Preenche data_local/hora_local das vendas gravadas antes dessas colunas."""
+    total = 0
+    while True:
+        vendas = Venda.query.filter(Venda.data_local.is_(None)).limit(lote).all()
+        if not vendas:
+            break
+        for v in vendas:
+            local = data_venda_local(v.data_venda)
+            v.data_local = local.date()
+            v.hora_local = local.hour
+        db.session.commit()
+        total += len(vendas)
+    return total
+
+
+@app.cli.command("preencher-data-local")
+@click.option("--lote", default=1000, show_default=True, help="Vendas atualizadas por commit.")
+def preencher_data_local_comando(lote):
+    """Preenche data_local/hora_local das vendas gravadas antes dessas colunas."""
+    total = preencher_data_local_pendentes(lote)
+    click.echo(f"{total} vendas atualizadas.")
+
+
+@app.cli.command("changes-tail")
+@click.option("--desde", default=0, show_default=True, help="Última sequência de alteração já processada.")
+@click.option("--seguir", "-f", is_flag=True, help="Continua esperando novas alterações.")
+@click.option("--intervalo", default=2.0, show_default=True, help="Segundos entre consultas com --seguir.")
+@click.option("--tabela", help="Só alterações desta tabela (venda, venda_item, item, despesa).")
+def changes_tail_comando(desde, seguir, intervalo, tabela):
+    """Mostra as alterações depois de --desde, uma por linha em JSON."""
+    pagina = 500
+    while True:
+        alteracoes = listar_alteracoes(desde, pagina, tabela)
+        # encerra a transação de leitura para enxergar os próximos commits
+        db.session.rollback()
+        for a in alteracoes:
+            click.echo(json.dumps(a, ensure_ascii=False))
+        if alteracoes:
+            desde = alteracoes[-1]["sequencia"]
+        if len(alteracoes) == pagina:
+            continue
+        if not seguir:
+            break
+        time.sleep(intervalo)
+
+
+@app.cli.command("limpar-alteracoes")
+@click.option("--dias", default=90, show_default=True, help="Mantém as alterações mais recentes que isso.")
+def limpar_alteracoes_comando(dias):
+    """Apaga do registro de alterações as entradas antigas, já consumidas."""
+    corte = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=dias)
+    apagadas = Alteracao.query.filter(Alteracao.criado_em < corte).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f"{apagadas} alterações apagadas.")
+
+
+def data_corte_arquivo():
+    """Primeiro dia ainda nas tabelas quentes, ou None se nada foi arquivado."""
+    marcador = db.session.get(Marcador, "arquivo_ano_corte")
+    if marcador is None or not marcador.valor:
+        return None
+    return date(marcador.valor, 1, 1)
+
+
+def rotear_vendas(inicio=None):
+    """Diz se vendas com data_local a partir de ``inicio`` devem ser lidas do arquivo.
+
+    As tabelas quentes são sempre consultadas: o filtro usa o índice de
+    data_local e também cobre vendas lançadas com data retroativa depois
+    do arquivamento. O arquivo só entra quando o intervalo alcança anos
+    arquivados.
+    """
+    corte = data_corte_arquivo()
+    return corte is not None and (inicio is None or inicio < corte)
+
+
+def fontes_vendas(inicio=None):
+    """Pares (venda, itens) de modelos a consultar para vendas a partir de ``inicio``."""
+    fontes = [(Venda, VendaItem)]
+    if rotear_vendas(inicio):
+        fontes.append((VendaArquivo, VendaItemArquivo))
+    return fontes
+
+
+def _filtro_intervalo(coluna, inicio=None, fim=None):
+    # vendas ainda sem data_local não têm dia para agrupar
+    condicoes = [coluna.is_not(None)]
+    if inicio is not None:
+        condicoes.append(coluna >= inicio)
+    if fim is not None:
+        condicoes.append(coluna < fim)
+    return db.and_(*condicoes)
+
+
+def _somar_por_chave(*resultados, chaves=1):
+    """Junta linhas (chave..., valor...) de várias consultas somando os valores."""
+    totais = {}
+    for linhas in resultados:
+        for linha in linhas:
+            chave = tuple(linha[:chaves])
+            valores = [v or 0 for v in linha[chaves:]]
+            if chave in totais:
+                totais[chave] = [a + b for a, b in zip(totais[chave], valores)]
+            else:
+                totais[chave] = valores
+    return [(*chave, *valores) for chave, valores in totais.items()]
+
+
+def _totais_ano(modelo_venda, modelo_item, ano):
+    """Contagens e somas usadas para conferir a cópia de um ano."""
+    no_ano = _filtro_intervalo(modelo_venda.data_local, date(ano, 1, 1), date(ano + 1, 1, 1))
+    vendas, valor, lucro = (
+        db.session.query(
+            func.count(modelo_venda.id),
+            func.coalesce(func.sum(modelo_venda.valor_total), 0),
+            func.coalesce(func.sum(modelo_venda.lucro_total), 0)
+        )
+        .filter(no_ano)
+        .one()
+    )
+    linhas = (
+        db.session.query(func.count(modelo_item.id))
+        .join(modelo_venda, modelo_venda.id == modelo_item.venda_id)
+        .filter(no_ano)
+        .scalar()
+    )
+    return {"vendas": vendas, "itens": linhas, "valor_total": valor, "lucro_total": lucro}
+
+
+def _conferir(esperado, obtido, etapa):
+    for campo, valor in esperado.items():
+        if abs((obtido[campo] or 0) - (valor or 0)) > 0.005:
+            raise click.ClickException(
+                f"Verificação falhou em {etapa}: {campo} esperado {valor}, obtido {obtido[campo]}"
+            )
+
+
+def arquivar_ano(ano, simular=False):
+    """Move as vendas de ``ano`` para o arquivo em uma única transação.
+
+    Copia vendas e itens, reconstrói o resumo diário do ano, confere
+    contagens e somas antes de apagar as linhas quentes e só então
+    avança o ano de corte. Com ``simular=True`` apenas conta.
+    """
+    inicio, fim = date(ano, 1, 1), date(ano + 1, 1, 1)
+    quentes = _totais_ano(Venda, VendaItem, ano)
+    if simular or not quentes["vendas"]:
+        return quentes
+
+    # a análise incremental só lê VendaItem: o que sair daqui sem ter sido
+    # somado antes não entraria mais na análise
+    if analise_desatualizada():
+        atualizar_analise_itens()
+
+    no_ano = _filtro_intervalo(Venda.data_local, inicio, fim)
+    ids_ano = db.select(Venda.id).where(no_ano)
+    antes = _totais_ano(VendaArquivo, VendaItemArquivo, ano)
+
+    try:
+        # segura o marcador até o commit para nenhuma atualização rodar no meio
+        marcador_analise = _travar_marcador_analise()
+        maior_item = (
+            db.session.query(func.max(VendaItem.id))
+            .filter(VendaItem.venda_id.in_(ids_ano))
+            .scalar()
+        )
+        if maior_item and (marcador_analise is None or marcador_analise.valor < maior_item):
+            raise click.ClickException(
+                f"A análise de itens ainda não somou as vendas de {ano}; "
+                "rode 'flask analise-itens' e tente de novo."
+            )
+
+        colunas_venda = [c.name for c in VendaArquivo.__table__.columns]
+        db.session.execute(
+            VendaArquivo.__table__.insert().from_select(
+                colunas_venda,
+                db.select(*[Venda.__table__.c[n] for n in colunas_venda]).where(no_ano)
+            )
+        )
+        colunas_item = [c.name for c in VendaItemArquivo.__table__.columns]
+        db.session.execute(
+            VendaItemArquivo.__table__.insert().from_select(
+                colunas_item,
+                db.select(*[VendaItem.__table__.c[n] for n in colunas_item])
+                .where(VendaItem.venda_id.in_(ids_ano))
+            )
+        )
+
+        depois = _totais_ano(VendaArquivo, VendaItemArquivo, ano)
+        _conferir(
+            {campo: antes[campo] + quentes[campo] for campo in quentes},
+            depois,
+            "cópia"
+        )
+
+        # resumo refeito a partir do arquivo: cobre reexecuções do mesmo ano
+        ResumoArquivo.query.filter(_filtro_intervalo(ResumoArquivo.data, inicio, fim)).delete()
+        db.session.execute(
+            ResumoArquivo.__table__.insert().from_select(
+                ["data", "forma_pagamento", "quantidade_vendas", "valor_total", "lucro_total"],
+                db.select(
+                    VendaArquivo.data_local,
+                    VendaArquivo.forma_pagamento,
+                    func.count(VendaArquivo.id),
+                    func.sum(VendaArquivo.valor_total),
+                    func.sum(VendaArquivo.lucro_total)
+                )
+                .where(_filtro_intervalo(VendaArquivo.data_local, inicio, fim))
+                .group_by(VendaArquivo.data_local, VendaArquivo.forma_pagamento)
+            )
+        )
+        vendas_resumo, valor_resumo, lucro_resumo = (
+            db.session.query(
+                func.coalesce(func.sum(ResumoArquivo.quantidade_vendas), 0),
+                func.coalesce(func.sum(ResumoArquivo.valor_total), 0),
+                func.coalesce(func.sum(ResumoArquivo.lucro_total), 0)
+            )
+            .filter(_filtro_intervalo(ResumoArquivo.data, inicio, fim))
+            .one()
+        )
+        _conferir(
+            {campo: depois[campo] for campo in ("vendas", "valor_total", "lucro_total")},
+            {"vendas": vendas_resumo, "valor_total": valor_resumo, "lucro_total": lucro_resumo},
+            "resumo"
+        )
+
+        dias_ano = [
+            dia for (dia,) in db.session.query(Venda.data_local).filter(no_ano).distinct()
+        ]
+        itens_apagados = (
+            VendaItem.query
+            .filter(VendaItem.venda_id.in_(ids_ano))
+            .delete(synchronize_session=False)
+        )
+        vendas_apagadas = Venda.query.filter(no_ano).delete(synchronize_session=False)
+        _conferir(
+            {"vendas": quentes["vendas"], "itens": quentes["itens"]},
+            {"vendas": vendas_apagadas, "itens": itens_apagados},
+            "remoção"
+        )
+
+        # as páginas desses dias passam a sair do arquivo (somente leitura);
+        # o comando roda fora do servidor, então só o marcador avisa os workers
+        invalidar_cache(*[cache_dia(dia) for dia in dias_ano])
+
+        marcador = db.session.get(Marcador, "arquivo_ano_corte")
+        if marcador is None:
+            marcador = Marcador(chave="arquivo_ano_corte", valor=0)
+            db.session.add(marcador)
+        marcador.valor = max(marcador.valor or 0, ano + 1)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return quentes
+
+
+@app.cli.command("archive")
+@click.option("--ate-ano", type=int, help="Último ano a arquivar (padrão: ano anterior ao atual).")
+@click.option("--dry-run", is_flag=True, help="Só mostra o que seria movido.")
+def archive_comando(ate_ano, dry_run):
+    """Move vendas de anos fechados para as tabelas de arquivo."""
+    ano_atual = datetime.now(TZ_BR).year
+    ate_ano = ate_ano or ano_atual - 1
+    if ate_ano >= ano_atual:
+        raise click.ClickException("Só é possível arquivar anos fechados.")
+
+    if Venda.query.filter(Venda.data_local.is_(None)).first():
+        raise click.ClickException("Há vendas sem data_local; rode 'flask preencher-data-local' antes.")
+
+    primeira = db.session.query(func.min(Venda.data_local)).scalar()
+    if primeira is None or primeira.year > ate_ano:
+        click.echo("Nenhuma venda para arquivar.")
+        return
+
+    for ano in range(primeira.year, ate_ano + 1):
+        totais = arquivar_ano(ano, simular=dry_run)
+        acao = "seriam movidas" if dry_run else "movidas e verificadas"
+        click.echo(
+            f"{ano}: {totais['vendas']} vendas e {totais['itens']} itens {acao} "
+            f"(R$ {totais['valor_total']:.2f})"
+        )
+
+
 # ---------------------
 # ROTAS
 # ---------------------
 
 #rota para importar dados json
 
+def _intervalo_mes(ano, mes):
+    """Primeiro dia do mês e primeiro dia do mês seguinte (intervalo para data_local)."""
+    inicio = date(ano, mes, 1)
+    fim = date(ano + 1, 1, 1) if mes == 12 else date(ano, mes + 1, 1)
+    return inicio, fim
+
+
+def _mes_pedido(mes):
+    """Intervalo de data_local do mês pedido; o ano vem de ?ano= (padrão: atual)."""
+    ano = request.args.get("ano", type=int) or datetime.now(TZ_BR).year
+    return _intervalo_mes(ano, mes)
+
+
 @app.route("/dados/pagamentos/<int:mes>")
+@somente_leitura
 def dados_pagamentos(mes):
-    resultados = (
+    inicio, fim = _mes_pedido(mes)
+    consultas = [
         db.session.query(Venda.forma_pagamento, func.sum(Venda.valor_total))
-        .filter(extract('month', Venda.data_venda) == mes)
+        .filter(_filtro_intervalo(Venda.data_local, inicio, fim))
         .group_by(Venda.forma_pagamento)
         .all()
-    )
+    ]
+    if rotear_vendas(inicio):
+        consultas.append(
+            db.session.query(ResumoArquivo.forma_pagamento, func.sum(ResumoArquivo.valor_total))
+            .filter(_filtro_intervalo(ResumoArquivo.data, inicio, fim))
+            .group_by(ResumoArquivo.forma_pagamento)
+            .all()
+        )
+    resultados = _somar_por_chave(*consultas)
     dados = [{"forma_pagamento": r[0], "total": float(r[1])} for r in resultados]
     return jsonify(dados)
 
 @app.route("/dados/categorias/<int:mes>")
+@somente_leitura
 def dados_categorias(mes):
-    resultados = (
-        db.session.query(Categoria.nome, func.sum(VendaItem.quantidade))
+    inicio, fim = _mes_pedido(mes)
+    consultas = [
+        db.session.query(Categoria.nome, func.sum(modelo_item.quantidade))
         .join(Item, Item.categoria_id == Categoria.id)
-        .join(VendaItem, VendaItem.item_id == Item.id)
-        .join(Venda, Venda.id == VendaItem.venda_id)
-        .filter(extract('month', Venda.data_venda) == mes)
+        .join(modelo_item, modelo_item.item_id == Item.id)
+        .join(modelo_venda, modelo_venda.id == modelo_item.venda_id)
+        .filter(_filtro_intervalo(modelo_venda.data_local, inicio, fim))
         .group_by(Categoria.nome)
         .all()
-    )
+        for modelo_venda, modelo_item in fontes_vendas(inicio)
+    ]
+    resultados = _somar_por_chave(*consultas)
     dados = [{"categoria": r[0], "quantidade": int(r[1])} for r in resultados]
     return jsonify(dados)
 
 @app.route("/dados/top-itens/<int:mes>")
+@somente_leitura
 def dados_top_itens(mes):
-    resultados = (
-        db.session.query(Item.nome, func.sum(VendaItem.quantidade))
-        .join(VendaItem, VendaItem.item_id == Item.id)
-        .join(Venda, Venda.id == VendaItem.venda_id)
-        .filter(extract('month', Venda.data_venda) == mes)
+    inicio, fim = _mes_pedido(mes)
+    consultas = [
+        db.session.query(Item.nome, func.sum(modelo_item.quantidade))
+        .join(modelo_item, modelo_item.item_id == Item.id)
+        .join(modelo_venda, modelo_venda.id == modelo_item.venda_id)
+        .filter(_filtro_intervalo(modelo_venda.data_local, inicio, fim))
         .group_by(Item.nome)
-        .order_by(func.sum(VendaItem.quantidade).desc())
-        .limit(10)
         .all()
-    )
+        for modelo_venda, modelo_item in fontes_vendas(inicio)
+    ]
+    resultados = sorted(_somar_por_chave(*consultas), key=lambda r: r[1], reverse=True)[:10]
     dados = [{"item": r[0], "quantidade": int(r[1])} for r in resultados]
     return jsonify(dados)
 
 @app.route("/dados/medias/<int:mes>")
+@somente_leitura
 def dados_medias(mes):
-    resultados = (
-        db.session.query(func.day(Venda.data_venda), func.avg(Venda.valor_total))
-        .filter(extract('month', Venda.data_venda) == mes)
-        .group_by(func.day(Venda.data_venda))
+    inicio, fim = _mes_pedido(mes)
+    consultas = [
+        db.session.query(Venda.data_local, func.sum(Venda.valor_total), func.count(Venda.id))
+        .filter(_filtro_intervalo(Venda.data_local, inicio, fim))
+        .group_by(Venda.data_local)
         .all()
-    )
-    dados = [{"dia": int(r[0]), "media_vendas": float(r[1])} for r in resultados]
+    ]
+    if rotear_vendas(inicio):
+        consultas.append(
+            db.session.query(
+                ResumoArquivo.data,
+                func.sum(ResumoArquivo.valor_total),
+                func.sum(ResumoArquivo.quantidade_vendas)
+            )
+            .filter(_filtro_intervalo(ResumoArquivo.data, inicio, fim))
+            .group_by(ResumoArquivo.data)
+            .all()
+        )
+    resultados = sorted(_somar_por_chave(*consultas))
+    dados = [{"dia": r[0].day, "media_vendas": float(r[1] / r[2])} for r in resultados if r[2]]
     return jsonify(dados)
 
 
@@ -174,98 +1332,94 @@ def logout():
     session.pop('usuario_id', None)
     return redirect(url_for("login"))
 
+def resumo_dia(data_sel):
+    """Totais, formas de pagamento e vendas por hora de um dia de Brasília."""
+    quantidade_vendas = 0
+    total_vendido = 0
+    total_lucro = 0
+    pagamentos = []
+    horas = []
+
+    for modelo_venda, _ in fontes_vendas(data_sel):
+        filtro = modelo_venda.data_local == data_sel
+
+        qtd, total, lucro = (
+            db.session.query(
+                func.count(modelo_venda.id),
+                func.coalesce(func.sum(modelo_venda.valor_total), 0),
+                func.coalesce(func.sum(modelo_venda.lucro_total), 0)
+            )
+            .filter(filtro)
+            .one()
+        )
+        quantidade_vendas += qtd
+        total_vendido += total
+        total_lucro += lucro
+
+        # Formas de pagamento
+        pagamentos.append(
+            db.session.query(modelo_venda.forma_pagamento, func.sum(modelo_venda.valor_total))
+            .filter(filtro)
+            .group_by(modelo_venda.forma_pagamento)
+            .all()
+        )
+
+        # Vendas por hora
+        horas.append(
+            db.session.query(modelo_venda.hora_local, func.count(modelo_venda.id))
+            .filter(filtro)
+            .group_by(modelo_venda.hora_local)
+            .all()
+        )
+
+    return {
+        "total_vendido": total_vendido,
+        "total_lucro": total_lucro,
+        "quantidade_vendas": quantidade_vendas,
+        "pagamentos_por_forma": dict(_somar_por_chave(*pagamentos)),
+        "vendas_por_hora": sorted(_somar_por_chave(*horas))
+    }
+
+
 @app.route("/dashboard")
+@somente_leitura
 def dashboard():
     if "usuario_id" not in session:
         return redirect(url_for("login"))
     
-    # Dados do dia anterior
-    from datetime import timedelta
-    ontem = datetime.now().date() - timedelta(days=1)
-    inicio = datetime.combine(ontem, datetime.min.time())
-    fim = datetime.combine(ontem, datetime.max.time())
-    
-    vendas_ontem = Venda.query.filter(
-        Venda.data_venda >= inicio,
-        Venda.data_venda <= fim
-    ).all()
-    
-    total_vendido = sum(v.valor_total for v in vendas_ontem)
-    total_lucro = sum(v.lucro_total for v in vendas_ontem)
-    quantidade_vendas = len(vendas_ontem)
-    
-    # Formas de pagamento
-    pagamentos_por_forma = {}
-    for v in vendas_ontem:
-        if v.forma_pagamento not in pagamentos_por_forma:
-            pagamentos_por_forma[v.forma_pagamento] = 0
-        pagamentos_por_forma[v.forma_pagamento] += v.valor_total
-    
-    # Vendas por hora
-    vendas_por_hora = {}
-    for v in vendas_ontem:
-        hora = v.data_venda.hour
-        if hora not in vendas_por_hora:
-            vendas_por_hora[hora] = 0
-        vendas_por_hora[hora] += 1
-    
-    # Converter para lista de tuplas ordenadas
-    vendas_por_hora_lista = sorted(vendas_por_hora.items())
+    # Dados do dia anterior (dia de Brasília)
+    ontem = datetime.now(TZ_BR).date() - timedelta(days=1)
+    resumo = resumo_dia(ontem)
     
     return render_template(
         "dashboard.html",
-        total_vendido=total_vendido,
-        total_lucro=total_lucro,
-        quantidade_vendas=quantidade_vendas,
-        pagamentos_por_forma=pagamentos_por_forma,
-        vendas_por_hora=vendas_por_hora_lista,
+        total_vendido=resumo["total_vendido"],
+        total_lucro=resumo["total_lucro"],
+        quantidade_vendas=resumo["quantidade_vendas"],
+        pagamentos_por_forma=resumo["pagamentos_por_forma"],
+        vendas_por_hora=resumo["vendas_por_hora"],
         data_hoje=ontem.strftime("%d/%m/%Y")
     )
 
 @app.route("/dados/dashboard/<data>")
+@somente_leitura
 def dados_dashboard(data):
     try:
         data_sel = datetime.strptime(data, "%Y-%m-%d").date()
     except ValueError:
         return jsonify({"erro": "Data inválida"}), 400
     
-    inicio = datetime.combine(data_sel, datetime.min.time())
-    fim = datetime.combine(data_sel, datetime.max.time())
-    
-    vendas = Venda.query.filter(
-        Venda.data_venda >= inicio,
-        Venda.data_venda <= fim
-    ).all()
-    
-    total_vendido = sum(v.valor_total for v in vendas)
-    total_lucro = sum(v.lucro_total for v in vendas)
-    quantidade_vendas = len(vendas)
-    
-    # Formas de pagamento
-    pagamentos_por_forma = {}
-    for v in vendas:
-        if v.forma_pagamento not in pagamentos_por_forma:
-            pagamentos_por_forma[v.forma_pagamento] = 0
-        pagamentos_por_forma[v.forma_pagamento] += v.valor_total
-    
-    # Vendas por hora
-    vendas_por_hora = {}
-    for v in vendas:
-        hora = v.data_venda.hour
-        if hora not in vendas_por_hora:
-            vendas_por_hora[hora] = 0
-        vendas_por_hora[hora] += 1
-    
-    # Ordenar horas
-    vendas_por_hora_ordenado = OrderedDict(sorted(vendas_por_hora.items()))
+    resumo = resumo_dia(data_sel)
+    total_vendido = resumo["total_vendido"]
+    quantidade_vendas = resumo["quantidade_vendas"]
     
     return jsonify({
         "total_vendido": round(total_vendido, 2),
-        "total_lucro": round(total_lucro, 2),
+        "total_lucro": round(resumo["total_lucro"], 2),
         "quantidade_vendas": quantidade_vendas,
         "ticket_medio": round(total_vendido / quantidade_vendas, 2) if quantidade_vendas > 0 else 0,
-        "pagamentos_por_forma": pagamentos_por_forma,
-        "vendas_por_hora": vendas_por_hora_ordenado,
+        "pagamentos_por_forma": resumo["pagamentos_por_forma"],
+        "vendas_por_hora": OrderedDict(resumo["vendas_por_hora"]),
         "data": data_sel.strftime("%d/%m/%Y")
     })
 
@@ -274,73 +1428,60 @@ def vendas():
     if "usuario_id" not in session:
         return redirect(url_for("login"))
 
-    tz_br = ZoneInfo("America/Sao_Paulo")
-
     data_str = request.args.get("data")
 
     try:
         data_sel = (
             datetime.strptime(data_str, "%d/%m/%Y").date()
             if data_str
-            else datetime.now(tz_br).date()
+            else datetime.now(TZ_BR).date()
         )
     except ValueError:
-        data_sel = datetime.now(tz_br).date()
-
-    inicio = datetime.combine(
-        data_sel,
-        datetime.min.time(),
-        tzinfo=tz_br
-    )
-
-    fim = datetime.combine(
-        data_sel,
-        datetime.max.time(),
-        tzinfo=tz_br
+        data_sel = datetime.now(TZ_BR).date()
+
+    versoes = versoes_cache(cache_dia(data_sel), "catalogo")
+
+    def contexto_vendas():
+        # vendas do dia de Brasília (data_local já convertida na gravação)
+        vendas = []
+        for modelo_venda, _ in fontes_vendas(data_sel):
+            vendas += modelo_venda.query.filter(
+                modelo_venda.data_local == data_sel
+            ).order_by(modelo_venda.data_venda.asc()).all()
+
+        # calcula total diário
+        total_diario = 0
+        for v in vendas:
+            for vi in v.itens:
+                total_diario += (vi.valor_venda - vi.desconto + vi.acrescimo)
+
+        return {"vendas": vendas, "total_diario": total_diario}
+
+    tabela_vendas = fragmento(
+        (cache_dia(data_sel), versoes[cache_dia(data_sel)], versoes["catalogo"]),
+        "fragmentos/vendas_tabela.html",
+        contexto_vendas
     )
 
-    inicio_utc = inicio.astimezone(timezone.utc)
-    fim_utc = fim.astimezone(timezone.utc)
-
-    # vendas do dia (UTC)
-    vendas = Venda.query.filter(
-        Venda.data_venda >= inicio_utc,
-        Venda.data_venda <= fim_utc
-    ).order_by(Venda.data_venda.asc()).all()
-
-    # converte data das vendas para Brasília
-    for v in vendas:
-        v.data_venda_br = v.data_venda.astimezone(tz_br)
-
     # itens disponíveis
-    itens = Item.query.order_by(Item.nome.asc()).all()
+    opcoes_itens = fragmento(
+        ("catalogo", "opcoes", versoes["catalogo"]),
+        "fragmentos/itens_opcoes.html",
+        lambda: {"itens": Item.query.order_by(Item.nome.asc()).all()}
+    )
 
     # carrinho da sessão
     carrinho = session.get("carrinho", [])
     total_carrinho = sum(i["valor_venda"] for i in carrinho)
 
-    # calcula total diário
-    total_diario = 0
-    for v in vendas:
-        for vi in v.itens:
-            total_diario += (vi.valor_venda - vi.desconto + vi.acrescimo)
-
-    # lista serializável de itens
-    itens_json = [
-        {"nome": i.nome, "preco_venda": i.preco_venda}
-        for i in itens
-    ]
-
     # 🔹 retorno único
     return render_template(
         "vendas.html",
         data_sel=data_sel.strftime("%d/%m/%Y"),
-        vendas=vendas,
-        itens=itens,
-        itens_json=itens_json,
+        tabela_vendas=tabela_vendas,
+        opcoes_itens=opcoes_itens,
         carrinho=carrinho,
-        total_carrinho=total_carrinho,
-        total_diario=total_diario
+        total_carrinho=total_carrinho
     )
 
 
@@ -357,23 +1498,13 @@ def adicionar_item():
         flash("Item não encontrado.", "danger")
         return redirect(url_for("vendas"))
 
-    preco_unitario = item.preco_venda
-
-    # Se quantidade foi informada, usa ela
-    if qtd_raw:
-        quantidade = float(qtd_raw)
-        valor_venda = (preco_unitario * quantidade) - desconto + acrescimo
-    # Se não, mas valor foi informado, calcula quantidade
-    elif valor_raw:
-        valor_informado = float(valor_raw)
-        quantidade = valor_informado / preco_unitario
-        valor_venda = valor_informado - desconto + acrescimo
-    else:
-        # Default: 1 unidade
-        quantidade = 1
-        valor_venda = preco_unitario - desconto + acrescimo
-
-    lucro = (preco_unitario - item.preco_compra) * quantidade - desconto + acrescimo
+    quantidade, valor_venda, lucro = calcular_linha_venda(
+        item,
+        quantidade=float(qtd_raw) if qtd_raw else None,
+        valor=float(valor_raw) if valor_raw else None,
+        desconto=desconto,
+        acrescimo=acrescimo
+    )
 
     carrinho = session.get("carrinho", [])
     carrinho.append({
@@ -395,8 +1526,6 @@ def adicionar_item():
 
 @app.route("/carrinho/finalizar", methods=["POST"])
 def concluir_venda():
-    tz_br = ZoneInfo("America/Sao_Paulo")
-
     forma_pagamento = request.form.get("forma_pagamento", "dinheiro")
     data_str = request.form.get("data_venda")  # ← agora existe
     carrinho = session.get("carrinho", [])
@@ -408,64 +1537,100 @@ def concluir_venda():
     # 📅 define a data da venda
     if data_str:
         data_base = datetime.strptime(data_str, "%d/%m/%Y").date()
-        hora_atual = datetime.now(tz_br).time()
+        hora_atual = datetime.now(TZ_BR).time()
 
         data_venda_br = datetime.combine(
             data_base,
             hora_atual,
-            tzinfo=tz_br
+            tzinfo=TZ_BR
         )
     else:
-        data_venda_br = datetime.now(tz_br)
+        data_venda_br = datetime.now(TZ_BR)
 
     # 🔐 bloqueia datas futuras
-    if data_venda_br > datetime.now(tz_br):
+    if data_venda_br > datetime.now(TZ_BR):
         flash("Data da venda inválida.", "danger")
         return redirect(url_for("vendas"))
 
     valor_total = sum(i["valor_venda"] for i in carrinho)
     lucro_total = sum(i["lucro"] for i in carrinho)
 
-    venda = Venda(
-        forma_pagamento=forma_pagamento,
-        valor_total=valor_total,
-        lucro_total=lucro_total,
-        data_venda=data_venda_br.astimezone(timezone.utc)  # ✅ correto
-    )
-
-    db.session.add(venda)
-    db.session.flush()
-
-    for i in carrinho:
-        vi = VendaItem(
-            venda_id=venda.id,
-            item_id=i["item_id"],
-            quantidade=i["quantidade"],
-            valor_venda=i["valor_venda"],
-            desconto=i["desconto"],
-            acrescimo=i["acrescimo"],
-            lucro=i["lucro"]
+    def gravar():
+        venda = Venda(
+            forma_pagamento=forma_pagamento,
+            valor_total=valor_total,
+            lucro_total=lucro_total,
+            data_venda=data_venda_br.astimezone(timezone.utc),  # ✅ correto
+            itens=[
+                VendaItem(
+                    item_id=i["item_id"],
+                    quantidade=i["quantidade"],
+                    valor_venda=i["valor_venda"],
+                    desconto=i["desconto"],
+                    acrescimo=i["acrescimo"],
+                    lucro=i["lucro"]
+                )
+                for i in carrinho
+            ]
         )
-        db.session.add(vi)
+        db.session.add(venda)
+        invalidar_cache(cache_dia(data_venda_br.date()))
+        db.session.commit()
 
-    db.session.commit()
+    executar_escrita(gravar)
     session.pop("carrinho", None)
 
     flash("Venda concluída!", "success")
     return redirect(url_for("vendas", data=data_str))
 
+
+MSG_CONFLITO = "A venda foi alterada em outro terminal. Recarregue a página e tente de novo."
+
+
+def ler_versao(valor):
+    """Versão enviada pela tela: None se ausente; ValueError se não for inteiro.
+
+    Uma versão ilegível não pode virar None, senão a gravação passaria sem checagem.
+    """
+    if valor in (None, ""):
+        return None
+    if isinstance(valor, bool):
+        raise ValueError(valor)
+    return int(valor)
+
+
 @app.route("/cancelar_venda", methods=["POST"])
 def cancelar_venda():
     venda_id = request.form.get("venda_id")
-    venda = Venda.query.get(venda_id)
+    try:
+        versao = ler_versao(request.form.get("versao"))
+    except ValueError:
+        flash(MSG_CONFLITO, "danger")
+        return redirect(url_for("vendas"))
 
-    if not venda:
-        flash("Venda não encontrada.", "danger")
+    def gravar():
+        venda = db.session.get(Venda, venda_id)
+        if not venda:
+            return False
+        if versao is not None and versao != venda.versao:
+            raise ConflitoVenda()
+
+        # Exemplo: remover a venda
+        remover_da_analise(venda.itens)
+        invalidar_cache(cache_da_venda(venda))
+        db.session.delete(venda)
+        db.session.commit()
+        return True
+
+    try:
+        encontrada = executar_escrita(gravar)
+    except ConflitoVenda:
+        flash(MSG_CONFLITO, "danger")
         return redirect(url_for("vendas"))
 
-    # Exemplo: remover a venda
-    db.session.delete(venda)
-    db.session.commit()
+    if not encontrada:
+        flash("Venda não encontrada.", "danger")
+        return redirect(url_for("vendas"))
 
     flash("Venda cancelada com sucesso.", "success")
     return redirect(url_for("vendas"))
@@ -473,72 +1638,527 @@ def cancelar_venda():
 @app.route("/editar_venda", methods=["POST"])
 def editar_venda():
     venda_id = request.form.get("venda_id")
-    venda = Venda.query.get(venda_id)
+    try:
+        versao = ler_versao(request.form.get("versao"))
+    except ValueError:
+        flash(MSG_CONFLITO, "danger")
+        return redirect(url_for("vendas"))
+    forma_pagamento = request.form.get("forma_pagamento")
+
+    # Lê e converte o formulário antes de abrir a transação de escrita
+    linhas = [
+        (nome, float(qtd), float(valor), float(desc), float(acres))
+        for nome, qtd, valor, desc, acres in zip(
+            request.form.getlist("item_nome[]"),
+            request.form.getlist("quantidade[]"),
+            request.form.getlist("valor[]"),
+            request.form.getlist("desconto[]"),
+            request.form.getlist("acrescimo[]")
+        )
+    ]
+    itens_por_nome = {}
+    for item in Item.query.filter(Item.nome.in_({linha[0] for linha in linhas})):
+        itens_por_nome.setdefault(item.nome, item)
+
+    def gravar():
+        venda = db.session.get(Venda, venda_id)
+        if not venda:
+            return False
+        if versao is not None and versao != venda.versao:
+            raise ConflitoVenda()
+
+        # Remove itens antigos (pela sessão, para entrarem no registro de alterações)
+        remover_da_analise(venda.itens)
+        for vi in venda.itens:
+            db.session.delete(vi)
+
+        # Recria itens com os novos valores
+        valor_total = 0
+        lucro_total = 0
+
+        for nome, quantidade, valor_venda, desconto, acrescimo in linhas:
+            item = itens_por_nome.get(nome)
+            if item:
+                lucro = (item.preco_venda - item.preco_compra) * quantidade - desconto + acrescimo
+
+                vi = VendaItem(
+                    venda_id=venda.id,
+                    item_id=item.id,
+                    quantidade=quantidade,
+                    valor_venda=valor_venda,
+                    desconto=desconto,
+                    acrescimo=acrescimo,
+                    lucro=lucro
+                )
+                db.session.add(vi)
+                valor_total += valor_venda
+                lucro_total += lucro
+
+        # Atualiza forma de pagamento e totais num único UPDATE (uma versão a mais);
+        # flag_modified garante a checagem de versão mesmo sem mudança nos valores
+        venda.forma_pagamento = forma_pagamento
+        venda.valor_total = valor_total
+        venda.lucro_total = lucro_total
+        flag_modified(venda, "forma_pagamento")
+        invalidar_cache(cache_da_venda(venda))
+        db.session.commit()
+        return True
 
-    if not venda:
+    try:
+        encontrada = executar_escrita(gravar)
+    except ConflitoVenda:
+        flash(MSG_CONFLITO, "danger")
+        return redirect(url_for("vendas"))
+
+    if not encontrada:
         flash("Venda não encontrada.", "danger")
         return redirect(url_for("vendas"))
 
-    # Atualiza forma de pagamento
-    venda.forma_pagamento = request.form.get("forma_pagamento")
+    flash("Venda atualizada com sucesso!", "success")
+    return redirect(url_for("vendas"))
+
+@app.route("/conferir_venda", methods=["POST"])
+def conferir_venda():
+    data = request.get_json()
+    try:
+        versao = ler_versao(data.get("versao"))
+    except (TypeError, ValueError):
+        return {"success": False, "erro": "Versão inválida"}, 400
+
+    def gravar():
+        venda = db.session.get(Venda, data["id"])
+        if not venda:
+            return None
+        if versao is not None and versao != venda.versao:
+            raise ConflitoVenda()
+        venda.conferido = data["conferido"]
+        invalidar_cache(cache_da_venda(venda))
+        db.session.flush()
+        nova_versao = venda.versao
+        db.session.commit()
+        return nova_versao
+
+    try:
+        nova_versao = executar_escrita(gravar)
+    except ConflitoVenda:
+        return {"success": False, "conflito": True, "erro": MSG_CONFLITO}, 409
+
+    if nova_versao is None:
+        return {"success": False}, 404
+
+    return {"success": True, "versao": nova_versao}
+
+
+def totais_conferencia(dia):
+    """Valores conferidos e pendentes por forma de pagamento de um dia, somados no banco."""
+    resultados = []
+    for modelo_venda, _ in fontes_vendas(dia):
+        conferida = modelo_venda.conferido.is_(True)
+        resultados.append(
+            db.session.query(
+                modelo_venda.forma_pagamento,
+                func.sum(case((conferida, modelo_venda.valor_total), else_=0)),
+                func.sum(case((conferida, 0), else_=modelo_venda.valor_total)),
+                func.sum(case((conferida, 1), else_=0)),
+                func.sum(case((conferida, 0), else_=1))
+            )
+            .filter(modelo_venda.data_local == dia)
+            .group_by(modelo_venda.forma_pagamento)
+            .all()
+        )
+
+    formas = [
+        {
+            "forma_pagamento": forma,
+            "conferido": round(conferido, 2),
+            "pendente": round(pendente, 2),
+            "vendas_conferidas": int(vendas_conferidas),
+            "vendas_pendentes": int(vendas_pendentes)
+        }
+        for forma, conferido, pendente, vendas_conferidas, vendas_pendentes
+        in sorted(_somar_por_chave(*resultados))
+    ]
+    return {
+        "formas": formas,
+        "conferido": round(sum(f["conferido"] for f in formas), 2),
+        "pendente": round(sum(f["pendente"] for f in formas), 2),
+        "vendas_pendentes": sum(f["vendas_pendentes"] for f in formas)
+    }
+
+
+def conferir_vendas(dia, conferido=True, ids=None, forma_pagamento=None):
+    """Marca num único UPDATE as vendas do dia, opcionalmente só ``ids`` ou uma forma de pagamento.
+
+    Só as vendas que mudam de estado são tocadas; cada uma ganha versão nova,
+    como na conferência individual, e entra no registro de alterações.
+    """
+    filtro = [Venda.data_local == dia, Venda.conferido != conferido]
+    if ids is not None:
+        filtro.append(Venda.id.in_(ids))
+    if forma_pagamento:
+        filtro.append(Venda.forma_pagamento == forma_pagamento)
+
+    linhas = db.session.execute(
+        db.update(Venda)
+        .where(*filtro)
+        .values(conferido=conferido, versao=Venda.versao + 1)
+        .returning(*Venda.__table__.c)
+        .execution_options(synchronize_session=False)
+    ).mappings().all()
+
+    registrar_alteracoes(Venda.__tablename__, "update", linhas)
+    if linhas:
+        invalidar_cache(cache_dia(dia))
+    return len(linhas)
+
+
+@app.route("/api/vendas/conferir", methods=["POST"])
+def api_conferir_vendas():
+    """Confere (ou desfaz a conferência de) várias vendas de um dia de uma vez.
+
+    JSON: ``data`` (AAAA-MM-DD), ``conferido`` (padrão true) e, para não pegar
+    o dia inteiro, ``ids`` e/ou ``forma_pagamento``. Devolve os totais do dia
+    por forma de pagamento já com a conferência aplicada.
+    """
+    if "usuario_id" not in session:
+        return jsonify({"erro": "Não autenticado"}), 401
+
+    dados = request.get_json(silent=True) or {}
+    try:
+        dia = date.fromisoformat(dados.get("data") or "")
+    except (TypeError, ValueError):
+        return jsonify({"erro": "Data inválida"}), 400
+
+    ids = dados.get("ids")
+    if ids is not None and (
+        not isinstance(ids, list)
+        or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+    ):
+        return jsonify({"erro": "ids deve ser uma lista de números"}), 400
 
-    # Remove itens antigos
-    VendaItem.query.filter_by(venda_id=venda.id).delete()
+    conferido = dados.get("conferido", True)
+    if not isinstance(conferido, bool):
+        return jsonify({"erro": "conferido deve ser true ou false"}), 400
 
-    # Recria itens com os novos valores
-    itens = zip(
-        request.form.getlist("item_nome[]"),
-        request.form.getlist("quantidade[]"),
-        request.form.getlist("valor[]"),
-        request.form.getlist("desconto[]"),
-        request.form.getlist("acrescimo[]")
+    forma_pagamento = dados.get("forma_pagamento")
+    if forma_pagamento is not None and not isinstance(forma_pagamento, str):
+        return jsonify({"erro": "forma_pagamento deve ser texto"}), 400
+
+    def gravar():
+        atualizadas = conferir_vendas(dia, conferido, ids, forma_pagamento)
+        db.session.commit()
+        return atualizadas
+
+    atualizadas = executar_escrita(gravar)
+    # o UPDATE em massa não passa pelo flush; marca a escrita para a leitura seguinte ficar no primário
+    g.houve_escrita = True
+
+    return jsonify({
+        "atualizadas": atualizadas,
+        "data": dia.isoformat(),
+        **totais_conferencia(dia)
+    })
+
+
+@app.route("/fechamento")
+def fechamento():
+    if "usuario_id" not in session:
+        return redirect(url_for("login"))
+
+    data_str = request.args.get("data")
+    try:
+        dia = (
+            datetime.strptime(data_str, "%d/%m/%Y").date()
+            if data_str else datetime.now(TZ_BR).date()
+        )
+    except ValueError:
+        dia = datetime.now(TZ_BR).date()
+
+    pendentes = (
+        Venda.query
+        .filter(Venda.data_local == dia, Venda.conferido.is_(False))
+        .order_by(Venda.data_venda.asc())
+        .all()
     )
 
-    valor_total = 0
-    lucro_total = 0
-
-    for nome, qtd, valor, desc, acres in itens:
-        item = Item.query.filter_by(nome=nome).first()
-        if item:
-            quantidade = float(qtd)
-            valor_venda = float(valor)
-            desconto = float(desc)
-            acrescimo = float(acres)
-            lucro = (item.preco_venda - item.preco_compra) * quantidade - desconto + acrescimo
-
-            vi = VendaItem(
-                venda_id=venda.id,
-                item_id=item.id,
-                quantidade=quantidade,
-                valor_venda=valor_venda,
-                desconto=desconto,
-                acrescimo=acrescimo,
-                lucro=lucro
-            )
-            db.session.add(vi)
-            valor_total += valor_venda
-            lucro_total += lucro
+    return render_template(
+        "fechamento.html",
+        data_sel=dia.strftime("%d/%m/%Y"),
+        data_iso=dia.isoformat(),
+        totais=totais_conferencia(dia),
+        pendentes=pendentes
+    )
 
-    venda.valor_total = valor_total
-    venda.lucro_total = lucro_total
-    db.session.commit()
+# Limite de vendas aceitas em uma única requisição de lote
+LOTE_VENDAS_MAX = 500
 
-    flash("Venda atualizada com sucesso!", "success")
-    return redirect(url_for("vendas"))
 
-@app.route("/conferir_venda", methods=["POST"])
-def conferir_venda():
-    data = request.get_json()
+def _numero(valor, padrao=None):
+    """Converte campos numéricos do JSON; string vazia ou None viram o padrão."""
+    if valor is None or valor == "":
+        return padrao
+    return float(valor)
 
-    venda = Venda.query.get(data["id"])
 
-    if venda:
-        venda.conferido = data["conferido"]
+def _chave_lote(valor):
+    """Chave de idempotência como texto; só aceita string ou número inteiro."""
+    if isinstance(valor, bool) or not isinstance(valor, (str, int)) or valor == "":
+        return None
+    return str(valor)
+
+
+def _item_da_linha(linha):
+    """(item_id, item_nome) da linha do lote; valores de tipo errado viram None."""
+    item_id = linha.get("item_id")
+    if isinstance(item_id, bool) or not isinstance(item_id, int):
+        item_id = None
+    item_nome = linha.get("item_nome")
+    item_nome = item_nome.strip() if isinstance(item_nome, str) else None
+    return item_id, item_nome
+
+
+def _data_venda_lote(valor, agora_br):
+    """Interpreta a data enviada pelo terminal (ISO 8601); sem fuso, assume Brasília."""
+    if not valor:
+        return agora_br
+    data_venda = datetime.fromisoformat(valor)
+    if data_venda.tzinfo is None:
+        data_venda = data_venda.replace(tzinfo=TZ_BR)
+    return data_venda
+
+
+@app.route("/api/vendas/lote", methods=["POST"])
+def api_vendas_lote():
+    """Recebe várias vendas de uma vez (pico de movimento ou terminal offline).
+
+    Cada venda traz uma ``chave`` gerada pelo terminal; reenviar o mesmo lote
+    não duplica vendas já gravadas. Os itens são resolvidos em uma consulta,
+    todas as vendas válidas são gravadas em uma única transação e cada venda
+    recebe seu próprio status.
+    """
+    if "usuario_id" not in session:
+        return jsonify({"erro": "Não autenticado"}), 401
+
+    dados = request.get_json(silent=True) or {}
+    lote = dados.get("vendas")
+
+    if not isinstance(lote, list) or not lote:
+        return jsonify({"erro": "Informe a lista de vendas"}), 400
+    if len(lote) > LOTE_VENDAS_MAX:
+        return jsonify({"erro": f"Máximo de {LOTE_VENDAS_MAX} vendas por lote"}), 400
+
+    agora_br = datetime.now(TZ_BR)
+
+    # cada tentativa refaz tudo: após o rollback as vendas montadas não valem mais
+    def gravar():
+        # 🔹 resolve chaves já gravadas e itens do lote em bloco
+        chaves = set()
+        ids_itens = set()
+        nomes_itens = set()
+        for v in lote:
+            if not isinstance(v, dict):
+                continue
+            chave = _chave_lote(v.get("chave"))
+            if chave:
+                chaves.add(chave)
+            linhas = v.get("itens")
+            if not isinstance(linhas, list):
+                continue
+            for linha in linhas:
+                if not isinstance(linha, dict):
+                    continue
+                # tipos errados ficam de fora; o laço abaixo marca a venda com erro
+                item_id, item_nome = _item_da_linha(linha)
+                if linha.get("item_id") is not None:
+                    if item_id is not None:
+                        ids_itens.add(item_id)
+                elif item_nome:
+                    nomes_itens.add(item_nome)
+
+        # inclui as vendas arquivadas: um terminal pode reenviar em janeiro o lote de 31/12
+        vendas_gravadas = {}
+        if chaves:
+            for modelo_venda, _ in fontes_vendas():
+                vendas_gravadas.update(
+                    db.session.query(modelo_venda.chave_idempotencia, modelo_venda.id)
+                    .filter(modelo_venda.chave_idempotencia.in_(chaves))
+                    .all()
+                )
+
+        itens_por_id = {}
+        itens_por_nome = {}
+        if ids_itens or nomes_itens:
+            for item in Item.query.filter(
+                db.or_(Item.id.in_(ids_itens), Item.nome.in_(nomes_itens))
+            ):
+                itens_por_id[item.id] = item
+                itens_por_nome.setdefault(item.nome, item)
+
+        # 🔹 valida e monta as vendas sem tocar no banco
+        resultados = []
+        novas = []
+        chaves_no_lote = {}
+
+        for v in lote:
+            if not isinstance(v, dict) or v.get("chave") in (None, ""):
+                resultados.append({"chave": None, "status": "erro", "erro": "Venda sem chave"})
+                continue
+
+            chave = _chave_lote(v["chave"])
+            if not chave:
+                resultados.append({"chave": None, "status": "erro", "erro": "Chave inválida"})
+                continue
+
+            if len(chave) > 64:
+                resultados.append({"chave": chave, "status": "erro", "erro": "Chave muito longa"})
+                continue
+            if chave in vendas_gravadas:
+                resultados.append({"chave": chave, "status": "duplicada", "venda_id": vendas_gravadas[chave]})
+                continue
+            if chave in chaves_no_lote:
+                resultados.append({"chave": chave, "status": "duplicada"})
+                continue
+
+            try:
+                data_venda_br = _data_venda_lote(v.get("data_venda"), agora_br)
+            except (TypeError, ValueError):
+                resultados.append({"chave": chave, "status": "erro", "erro": "Data inválida"})
+                continue
+
+            # 🔐 bloqueia datas futuras
+            if data_venda_br > agora_br:
+                resultados.append({"chave": chave, "status": "erro", "erro": "Data da venda inválida"})
+                continue
+
+            forma_pagamento = v.get("forma_pagamento") or "dinheiro"
+            if not isinstance(forma_pagamento, str) or len(forma_pagamento) > 50:
+                resultados.append({"chave": chave, "status": "erro", "erro": "Forma de pagamento inválida"})
+                continue
+
+            linhas = v.get("itens") or []
+            if not isinstance(linhas, list) or not linhas:
+                resultados.append({"chave": chave, "status": "erro", "erro": "Venda sem itens"})
+                continue
+
+            itens_venda = []
+            erro = None
+            for linha in linhas:
+                if not isinstance(linha, dict):
+                    erro = "Item inválido"
+                    break
+                item_id, item_nome = _item_da_linha(linha)
+                if linha.get("item_id") is not None:
+                    if item_id is None:
+                        erro = "Item inválido"
+                        break
+                    item = itens_por_id.get(item_id)
+                else:
+                    if linha.get("item_nome") is not None and item_nome is None:
+                        erro = "Item inválido"
+                        break
+                    item = itens_por_nome.get(item_nome or "")
+                if not item:
+                    erro = "Item não encontrado"
+                    break
+                try:
+                    desconto = _numero(linha.get("desconto"), 0)
+                    acrescimo = _numero(linha.get("acrescimo"), 0)
+                    quantidade, valor_venda, lucro = calcular_linha_venda(
+                        item,
+                        quantidade=_numero(linha.get("quantidade")),
+                        valor=_numero(linha.get("valor")),
+                        desconto=desconto,
+                        acrescimo=acrescimo
+                    )
+                except (TypeError, ValueError, ZeroDivisionError):
+                    erro = "Valores inválidos"
+                    break
+                itens_venda.append(VendaItem(
+                    item_id=item.id,
+                    quantidade=quantidade,
+                    valor_venda=valor_venda,
+                    desconto=desconto,
+                    acrescimo=acrescimo,
+                    lucro=lucro
+                ))
+
+            if erro:
+                resultados.append({"chave": chave, "status": "erro", "erro": erro})
+                continue
+
+            venda = Venda(
+                forma_pagamento=forma_pagamento,
+                valor_total=sum(vi.valor_venda for vi in itens_venda),
+                lucro_total=sum(vi.lucro for vi in itens_venda),
+                data_venda=data_venda_br.astimezone(timezone.utc),
+                chave_idempotencia=chave,
+                itens=itens_venda
+            )
+            chaves_no_lote[chave] = venda
+            novas.append(venda)
+            resultados.append({"chave": chave, "status": "criada", "venda": venda})
+
+        # 🔹 grava todas as vendas válidas em uma única transação
+        if novas:
+            db.session.add_all(novas)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # outro envio gravou a mesma chave ao mesmo tempo; o lote é
+                # descartado e pode ser reenviado com segurança
+                db.session.rollback()
+                return None
+            invalidar_cache(*{cache_da_venda(v) for v in novas})
+
+        # ids lidos antes do commit para não recarregar cada venda depois
+        for r in resultados:
+            if r["status"] == "duplicada" and "venda_id" not in r:
+                r["venda_id"] = chaves_no_lote[r["chave"]].id
+            elif r["status"] == "criada":
+                r["venda_id"] = r.pop("venda").id
+
         db.session.commit()
-        return {"success": True}
+        return resultados
 
-    return {"success": False}, 404
+    resultados = executar_escrita(gravar)
+    if resultados is None:
+        return jsonify({"erro": "Conflito de chave, reenvie o lote"}), 409
 
+    return jsonify({
+        "criadas": sum(1 for r in resultados if r["status"] == "criada"),
+        "duplicadas": sum(1 for r in resultados if r["status"] == "duplicada"),
+        "erros": sum(1 for r in resultados if r["status"] == "erro"),
+        "resultados": resultados
+    })
+
+
+# Limite de alterações devolvidas por página de /changes
+ALTERACOES_PAGINA_MAX = 1000
+
+
+@app.route("/changes")
+def changes():
+    """Alterações de vendas, itens e despesas depois do cursor ``since``.
+
+    O consumidor guarda o ``proximo`` da resposta e o envia como ``since``
+    na chamada seguinte; uma página cheia indica que há mais para ler. O
+    cursor segue a ordem de commit (``sequencia``), então uma alteração que
+    ainda não apareceu nunca recebe número menor que o já lido.
+    """
+    if "usuario_id" not in session:
+        return jsonify({"erro": "Não autenticado"}), 401
+
+    desde = request.args.get("since", 0, type=int)
+    limite = request.args.get("limite", 500, type=int)
+    if desde < 0 or not 1 <= limite <= ALTERACOES_PAGINA_MAX:
+        return jsonify({"erro": f"since >= 0 e limite entre 1 e {ALTERACOES_PAGINA_MAX}"}), 400
+
+    alteracoes = listar_alteracoes(desde, limite, request.args.get("tabela"))
+
+    return jsonify({
+        "alteracoes": alteracoes,
+        "proximo": alteracoes[-1]["sequencia"] if alteracoes else desde
+    })
 
 @app.route("/itens", methods=["GET"])
 def itens():
@@ -547,21 +2167,34 @@ def itens():
 
     q = request.args.get("q", "").strip()
 
-    # Use contains para evitar problemas com ilike em alguns setups
-    if q:
+    categorias = Categoria.query.all()
+
+    pesquisando = bool(q)
+
+    if pesquisando:
+        # Use contains para evitar problemas com ilike em alguns setups
         itens = Item.query.filter(Item.nome.contains(q)).order_by(Item.nome.asc()).all()
+        linhas_itens = Markup(render_template("fragmentos/itens_linhas.html", itens=itens))
+        modais_itens = Markup(render_template(
+            "fragmentos/itens_modais.html", itens=itens, categorias=categorias
+        ))
+        nenhum_resultado = len(itens) == 0
     else:
-        itens = Item.query.order_by(Item.nome.asc()).all()
+        # catálogo completo: tabela e modais saem do cache enquanto o catálogo não mudar
+        versao = versoes_cache("catalogo")["catalogo"]
 
-    categorias = Categoria.query.all()
+        def contexto_itens():
+            return {"itens": Item.query.order_by(Item.nome.asc()).all(), "categorias": categorias}
 
-    pesquisando = bool(q)
-    nenhum_resultado = pesquisando and len(itens) == 0
+        linhas_itens = fragmento(("catalogo", "linhas", versao), "fragmentos/itens_linhas.html", contexto_itens)
+        modais_itens = fragmento(("catalogo", "modais", versao), "fragmentos/itens_modais.html", contexto_itens)
+        nenhum_resultado = False
 
     return render_template(
         "itens.html",
         categorias=categorias,
-        itens=itens,
+        linhas_itens=linhas_itens,
+        modais_itens=modais_itens,
         pesquisando=pesquisando,
         nenhum_resultado=nenhum_resultado,
         q=q
@@ -578,6 +2211,7 @@ def cadastrar_ou_editar_item():
     if delete_id:
         item = Item.query.get_or_404(int(delete_id))
         db.session.delete(item)
+        invalidar_cache("catalogo")
         db.session.commit()
         return redirect(url_for("itens"))
 
@@ -607,35 +2241,62 @@ def cadastrar_ou_editar_item():
         )
         db.session.add(novo_item)
 
+    invalidar_cache("catalogo")
     db.session.commit()
     return redirect(url_for("itens"))
 
 
 @app.route("/relatorios")
+@somente_leitura
 def relatorios():
     if "usuario_id" not in session:
         return redirect(url_for("login"))
 
     from sqlalchemy import extract, func
 
-    vendas = (
-        db.session.query(
-            extract('month', Venda.data_venda).label('mes'),
-            func.sum(Venda.valor_total).label('valor_total')
-        )
-        .group_by('mes')
+    arquivo = rotear_vendas()
+
+    # vendas e pagamentos de anos arquivados vêm do resumo diário
+    mes_venda = extract('month', Venda.data_local)
+    mes_resumo = extract('month', ResumoArquivo.data)
+    consultas = [
+        db.session.query(mes_venda, func.sum(Venda.valor_total))
+        .filter(_filtro_intervalo(Venda.data_local))
+        .group_by(mes_venda)
         .all()
-    )
+    ]
+    if arquivo:
+        consultas.append(
+            db.session.query(mes_resumo, func.sum(ResumoArquivo.valor_total)).group_by(mes_resumo).all()
+        )
+    vendas = [
+        {"mes": int(mes), "valor_total": total}
+        for mes, total in sorted(_somar_por_chave(*consultas))
+    ]
 
-    pagamentos = (
+    consultas = [
         db.session.query(
             Venda.forma_pagamento,
-            func.count(Venda.id).label('quantidade'),
-            func.sum(Venda.valor_total).label('total')
+            func.count(Venda.id),
+            func.sum(Venda.valor_total)
         )
         .group_by(Venda.forma_pagamento)
         .all()
-    )
+    ]
+    if arquivo:
+        consultas.append(
+            db.session.query(
+                ResumoArquivo.forma_pagamento,
+                func.sum(ResumoArquivo.quantidade_vendas),
+                func.sum(ResumoArquivo.valor_total)
+            )
+            .group_by(ResumoArquivo.forma_pagamento)
+            .all()
+        )
+    pagamentos = [
+        {"forma_pagamento": forma, "quantidade": qtd, "total": total}
+        for forma, qtd, total in _somar_por_chave(*consultas)
+    ]
 
     categorias = (
         db.session.query(
@@ -647,27 +2308,45 @@ def relatorios():
         .all()
     )
 
-    itens = (
+    consultas = [
         db.session.query(
-            Item.nome.label("item"),
-            func.sum(VendaItem.quantidade).label('quantidade'),
-            func.sum(VendaItem.valor_venda).label('total')
+            Item.nome,
+            func.sum(modelo_item.quantidade),
+            func.sum(modelo_item.valor_venda)
         )
-        .join(Item, VendaItem.item_id == Item.id)
+        .join(Item, modelo_item.item_id == Item.id)
         .group_by(Item.nome)
-        .order_by(func.sum(VendaItem.quantidade).desc())
-        .limit(10)
         .all()
-    )
+        for _, modelo_item in fontes_vendas()
+    ]
+    itens = [
+        {"item": nome, "quantidade": qtd, "total": total}
+        for nome, qtd, total in sorted(_somar_por_chave(*consultas), key=lambda r: r[1], reverse=True)[:10]
+    ]
 
-    medias = (
-        db.session.query(
-            extract('day', Venda.data_venda).label('dia'),
-            func.avg(Venda.valor_total).label('media_vendas')
-        )
-        .group_by('dia')
+    dia_venda = extract('day', Venda.data_local)
+    dia_resumo = extract('day', ResumoArquivo.data)
+    consultas = [
+        db.session.query(dia_venda, func.sum(Venda.valor_total), func.count(Venda.id))
+        .filter(_filtro_intervalo(Venda.data_local))
+        .group_by(dia_venda)
         .all()
-    )
+    ]
+    if arquivo:
+        consultas.append(
+            db.session.query(
+                dia_resumo,
+                func.sum(ResumoArquivo.valor_total),
+                func.sum(ResumoArquivo.quantidade_vendas)
+            )
+            .group_by(dia_resumo)
+            .all()
+        )
+    medias = [
+        {"dia": int(dia), "media_vendas": total / qtd}
+        for dia, total, qtd in sorted(_somar_por_chave(*consultas))
+        if qtd
+    ]
 
     return render_template(
         "relatorios.html",
@@ -679,7 +2358,68 @@ def relatorios():
     )
 
 
+@app.route("/analise-itens")
+def analise_itens():
+    if "usuario_id" not in session:
+        return redirect(url_for("login"))
+
+    analises = listar_analise_itens()
+    receita_total = sum(a["receita"] for a in analises)
+    lucro_total = sum(a["lucro"] for a in analises)
+
+    resumo_abc = {classe: {"itens": 0, "receita": 0} for classe in ("A", "B", "C")}
+    for a in analises:
+        resumo_abc[a["classe_abc"]]["itens"] += 1
+        resumo_abc[a["classe_abc"]]["receita"] += a["receita"]
+
+    return render_template(
+        "analise_itens.html",
+        analises=analises,
+        receita_total=receita_total,
+        lucro_total=lucro_total,
+        resumo_abc=resumo_abc
+    )
+
+
+@app.route("/dados/analise-itens")
+def dados_analise_itens():
+    return jsonify(listar_analise_itens())
+
+
+def receitas_por_mes(ano=None):
+    """Receita de vendas agrupada por (ano, mês) de Brasília, calculada no banco.
+
+    Anos arquivados são lidos do resumo diário em vez das vendas.
+    """
+    inicio, fim = (date(ano, 1, 1), date(ano + 1, 1, 1)) if ano is not None else (None, None)
+
+    ano_col = extract('year', Venda.data_local)
+    mes_col = extract('month', Venda.data_local)
+    consultas = [
+        db.session.query(ano_col, mes_col, func.sum(Venda.valor_total))
+        .filter(_filtro_intervalo(Venda.data_local, inicio, fim))
+        .group_by(ano_col, mes_col)
+        .all()
+    ]
+
+    if rotear_vendas(inicio):
+        ano_col = extract('year', ResumoArquivo.data)
+        mes_col = extract('month', ResumoArquivo.data)
+        consultas.append(
+            db.session.query(ano_col, mes_col, func.sum(ResumoArquivo.valor_total))
+            .filter(_filtro_intervalo(ResumoArquivo.data, inicio, fim))
+            .group_by(ano_col, mes_col)
+            .all()
+        )
+
+    return [
+        (int(a), int(m), total)
+        for a, m, total in _somar_por_chave(*consultas, chaves=2)
+    ]
+
+
 @app.route("/financeiro")
+@somente_leitura
 def financeiro():
     # categories available for filtering
     categorias = ["Todas", "Compra", "Pessoal", "Operacional"]
@@ -701,21 +2441,18 @@ def financeiro():
             continue
         despesas.append(d)
 
-    vendas = Venda.query.all()
     categorias_grafico = {"Compra", "Operacional"}
     despesas_grafico = [d for d in todas_despesas if d.categoria in categorias_grafico]
 
     # Agrupar por ano/mês
     saldos_por_ano = {}
 
-    for v in vendas:
-        ano = v.data_venda.year
-        mes = v.data_venda.month
+    for ano, mes, total in receitas_por_mes():
         if ano not in saldos_por_ano:
             saldos_por_ano[ano] = {}
         if mes not in saldos_por_ano[ano]:
             saldos_por_ano[ano][mes] = {"receitas": 0, "despesas": 0}
-        saldos_por_ano[ano][mes]["receitas"] += v.valor_total
+        saldos_por_ano[ano][mes]["receitas"] += total
 
     for d in despesas_grafico:
         ano = d.data_despesa.year
@@ -812,22 +2549,20 @@ def financeiro_excluir():
 
 
 @app.route("/financeiro_dados/<int:ano>")
+@somente_leitura
 def financeiro_dados(ano):
     # mesma lógica de agrupamento, mas filtrando pelo ano
     categorias_grafico = {"Compra", "Operacional"}
     despesas = Despesa.query.filter(Despesa.categoria.in_(categorias_grafico)).all()
-    vendas = Venda.query.all()
 
     saldos_por_ano = {}
 
-    for v in vendas:
-        a = v.data_venda.year
-        m = v.data_venda.month
+    for a, m, total in receitas_por_mes(ano):
         if a not in saldos_por_ano:
             saldos_por_ano[a] = {}
         if m not in saldos_por_ano[a]:
             saldos_por_ano[a][m] = {"receitas": 0, "despesas": 0}
-        saldos_por_ano[a][m]["receitas"] += v.valor_total
+        saldos_por_ano[a][m]["receitas"] += total
 
     for d in despesas:
         a = d.data_despesa.year
@@ -846,6 +2581,7 @@ def financeiro_dados(ano):
 
 
 @app.route("/financeiro_totais")
+@somente_leitura
 def financeiro_totais():
     # retorna totais por categoria para um ano/mês especificado (ou valores atuais)
     ano = int(request.args.get("ano", datetime.now().year))
@@ -867,6 +2603,7 @@ def financeiro_totais():
 # MAIN
 # ---------------------
 if __name__ == "__main__":
+    # aplica as migrations pendentes (create_all deixaria o banco fora do controle do Alembic)
     with app.app_context():
-        db.create_all()
+        upgrade()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Simula N caixas concorrentes sobre as mesmas vendas e mede vazão e conflitos.
+
+Uso:
+    python benchmarks/bench_concorrencia.py [--caixas 8] [--operacoes 100] [--vendas 5]
+
+Cada caixa é uma thread com seu próprio cliente de teste do Flask. As
+operações misturam vendas novas, conferência, edição e cancelamento sobre
+as vendas mais recentes, para forçar disputa pelas mesmas linhas. Roda contra um SQLite temporário.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "bench.db")
+
+from app import app, db, Usuario, Categoria, Item, Venda, MSG_CONFLITO  # noqa: E402
+
+
+def preparar(vendas):
+    with app.app_context():
+        db.create_all(bind_key=None)
+        usuario = Usuario(usuario="bench", senha="bench")
+        categoria = Categoria(nome="Ração")
+        db.session.add_all([usuario, categoria])
+        db.session.flush()
+        for n in range(10):
+            db.session.add(Item(
+                nome=f"Item {n}",
+                preco_compra=10 + n,
+                preco_venda=15 + n,
+                margem_lucro=50,
+                categoria_id=categoria.id
+            ))
+        db.session.commit()
+        usuario_id = usuario.id
+
+    client = cliente_logado(usuario_id)
+    for n in range(vendas):
+        criar_venda(client, n)
+    return usuario_id
+
+
+def cliente_logado(usuario_id):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["usuario_id"] = usuario_id
+    return client
+
+
+def criar_venda(client, n):
+    client.post("/carrinho/adicionar", data={"item_nome": f"Item {n % 10}", "quantidade": "1"})
+    return client.post("/carrinho/finalizar", data={"forma_pagamento": "pix"})
+
+
+def ler_venda(disputadas):
+    """Simula o caixa olhando a tela: lê uma das vendas mais recentes."""
+    with app.app_context():
+        recentes = (
+            db.session.query(Venda.id, Venda.versao, Venda.conferido)
+            .order_by(Venda.id.desc())
+            .limit(disputadas)
+            .all()
+        )
+        return random.choice(recentes) if recentes else None
+
+
+def mensagens_flash(client):
+    with client.session_transaction() as s:
+        return [m for _, m in s.pop("_flashes", [])]
+
+
+def caixa(usuario_id, disputadas, operacoes, resultados, trava):
+    client = cliente_logado(usuario_id)
+    contagem = Counter()
+
+    for n in range(operacoes):
+        operacao = random.choices(
+            ["venda", "conferir", "editar", "cancelar"],
+            weights=[4, 4, 3, 1]
+        )[0]
+
+        if operacao == "venda":
+            resp = criar_venda(client, n)
+            mensagens_flash(client)
+            contagem["ok" if resp.status_code == 302 else "erro"] += 1
+            continue
+
+        vista = ler_venda(disputadas)
+        if vista is None:
+            contagem["inexistente"] += 1
+            continue
+        venda_id, versao, conferido = vista
+        # tempo de "pensar" do caixa entre ler a tela e enviar
+        time.sleep(random.uniform(0, 0.005))
+
+        if operacao == "conferir":
+            resp = client.post("/conferir_venda", json={
+                "id": venda_id, "versao": versao, "conferido": not conferido
+            })
+            if resp.status_code == 200:
+                contagem["ok"] += 1
+            elif resp.status_code == 409:
+                contagem["conflito"] += 1
+            elif resp.status_code == 404:
+                contagem["inexistente"] += 1
+            else:
+                contagem["erro"] += 1
+            continue
+
+        if operacao == "editar":
+            resp = client.post("/editar_venda", data={
+                "venda_id": venda_id,
+                "versao": versao,
+                "forma_pagamento": random.choice(["pix", "dinheiro", "debito"]),
+                "item_nome[]": [f"Item {random.randrange(10)}"],
+                "quantidade[]": ["2"],
+                "valor[]": ["30"],
+                "desconto[]": ["0"],
+                "acrescimo[]": ["0"]
+            })
+        else:
+            resp = client.post("/cancelar_venda", data={"venda_id": venda_id, "versao": versao})
+
+        mensagens = mensagens_flash(client)
+        if resp.status_code != 302:
+            contagem["erro"] += 1
+        elif MSG_CONFLITO in mensagens:
+            contagem["conflito"] += 1
+        elif "Venda não encontrada." in mensagens:
+            contagem["inexistente"] += 1
+        else:
+            contagem["ok"] += 1
+
+    with trava:
+        resultados.update(contagem)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--caixas", type=int, default=8)
+    parser.add_argument("--operacoes", type=int, default=100)
+    parser.add_argument("--vendas", type=int, default=5, help="Vendas mais recentes em disputa.")
+    args = parser.parse_args()
+
+    usuario_id = preparar(args.vendas)
+
+    resultados = Counter()
+    trava = threading.Lock()
+    threads = [
+        threading.Thread(target=caixa, args=(usuario_id, args.vendas, args.operacoes, resultados, trava))
+        for _ in range(args.caixas)
+    ]
+
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    total = sum(resultados.values())
+    print(f"{args.caixas} caixas, {total} operações em {duracao:.2f}s: {total / duracao:.1f} op/s")
+    for chave in ("ok", "conflito", "inexistente", "erro"):
+        print(f"  {chave:12s} {resultados[chave]:6d}  ({resultados[chave] / total * 100:5.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Mede a vazão (vendas/segundo) do envio em lote contra o fluxo do carrinho.
+
+Uso:
+    python benchmarks/bench_vendas_lote.py [--vendas 2000] [--lote 200]
+
+Roda contra um SQLite temporário; não toca no banco configurado em DATABASE_URL.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "bench.db")
+
+from app import app, db, Usuario, Categoria, Item  # noqa: E402
+
+
+def preparar():
+    with app.app_context():
+        db.create_all()
+        db.session.add(Usuario(usuario="bench", senha="bench"))
+        categoria = Categoria(nome="Ração")
+        db.session.add(categoria)
+        db.session.flush()
+        for n in range(50):
+            db.session.add(Item(
+                nome=f"Item {n}",
+                preco_compra=10 + n,
+                preco_venda=15 + n,
+                margem_lucro=50,
+                categoria_id=categoria.id
+            ))
+        db.session.commit()
+        return Usuario.query.filter_by(usuario="bench").first().id
+
+
+def cliente_logado(usuario_id):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["usuario_id"] = usuario_id
+    return client
+
+
+def venda_json(n):
+    return {
+        "chave": uuid.uuid4().hex,
+        "forma_pagamento": "pix",
+        "itens": [
+            {"item_nome": f"Item {(n + k) % 50}", "quantidade": 1 + k, "desconto": 0.5}
+            for k in range(3)
+        ]
+    }
+
+
+def medir_carrinho(client, total):
+    inicio = time.perf_counter()
+    for n in range(total):
+        for k in range(3):
+            client.post("/carrinho/adicionar", data={
+                "item_nome": f"Item {(n + k) % 50}",
+                "quantidade": str(1 + k),
+                "desconto": "0.5"
+            })
+        client.post("/carrinho/finalizar", data={"forma_pagamento": "pix"})
+    return total / (time.perf_counter() - inicio)
+
+
+def medir_lote(client, total, tamanho):
+    inicio = time.perf_counter()
+    enviadas = 0
+    while enviadas < total:
+        n = min(tamanho, total - enviadas)
+        resp = client.post("/api/vendas/lote", json={
+            "vendas": [venda_json(enviadas + k) for k in range(n)]
+        })
+        assert resp.status_code == 200, resp.get_data(as_text=True)
+        assert resp.get_json()["criadas"] == n
+        enviadas += n
+    return total / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vendas", type=int, default=2000)
+    parser.add_argument("--lote", type=int, default=200)
+    args = parser.parse_args()
+
+    usuario_id = preparar()
+    client = cliente_logado(usuario_id)
+
+    # o carrinho faz 4 requisições e um commit por venda; usa uma amostra menor
+    amostra = max(1, args.vendas // 10)
+    carrinho = medir_carrinho(client, amostra)
+    lote = medir_lote(client, args.vendas, args.lote)
+
+    print(f"carrinho (1 venda por POST): {carrinho:10.1f} vendas/s  ({amostra} vendas)")
+    print(f"lote ({args.lote} por POST):       {lote:10.1f} vendas/s  ({args.vendas} vendas)")
+
+
+if __name__ == "__main__":
+    main()
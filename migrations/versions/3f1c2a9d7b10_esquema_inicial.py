@@ -0,0 +1,106 @@
+"""esquema inicial (usuario, categoria, item, venda, venda_item, despesa)
+
+Os bancos em uso foram criados antes das migrations, então cada tabela só é
+criada se ainda não existir; num banco existente o upgrade apenas registra a
+revisão (e acrescenta venda.conferido nos bancos criados antes dessa coluna).
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existentes = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'usuario' not in existentes:
+        op.create_table(
+            'usuario',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('usuario', sa.String(length=100), nullable=False),
+            sa.Column('senha', sa.String(length=100), nullable=False),
+            sa.Column('data_cadastro', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('usuario')
+        )
+    if 'categoria' not in existentes:
+        op.create_table(
+            'categoria',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('nome', sa.String(length=100), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('nome')
+        )
+    if 'item' not in existentes:
+        op.create_table(
+            'item',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('nome', sa.String(length=100), nullable=False),
+            sa.Column('preco_compra', sa.Float(), nullable=False),
+            sa.Column('preco_venda', sa.Float(), nullable=False),
+            sa.Column('margem_lucro', sa.Float(), nullable=True),
+            sa.Column('data_cadastro', sa.DateTime(), nullable=True),
+            sa.Column('categoria_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['categoria_id'], ['categoria.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'venda' not in existentes:
+        op.create_table(
+            'venda',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('forma_pagamento', sa.String(length=50), nullable=False),
+            sa.Column('data_venda', sa.DateTime(), nullable=True),
+            sa.Column('valor_total', sa.Float(), nullable=False),
+            sa.Column('lucro_total', sa.Float(), nullable=False),
+            sa.Column('conferido', sa.Boolean(), server_default=sa.false(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    elif 'conferido' not in {c['name'] for c in sa.inspect(op.get_bind()).get_columns('venda')}:
+        op.add_column(
+            'venda',
+            sa.Column('conferido', sa.Boolean(), server_default=sa.false(), nullable=False)
+        )
+    if 'venda_item' not in existentes:
+        op.create_table(
+            'venda_item',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('venda_id', sa.Integer(), nullable=False),
+            sa.Column('item_id', sa.Integer(), nullable=False),
+            sa.Column('quantidade', sa.Integer(), nullable=False),
+            sa.Column('valor_venda', sa.Float(), nullable=False),
+            sa.Column('desconto', sa.Float(), nullable=True),
+            sa.Column('acrescimo', sa.Float(), nullable=True),
+            sa.Column('lucro', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['item_id'], ['item.id']),
+            sa.ForeignKeyConstraint(['venda_id'], ['venda.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if 'despesa' not in existentes:
+        op.create_table(
+            'despesa',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('descricao', sa.String(length=150), nullable=False),
+            sa.Column('valor', sa.Float(), nullable=False),
+            sa.Column('data_despesa', sa.DateTime(), nullable=True),
+            sa.Column('categoria', sa.String(length=50), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('despesa')
+    op.drop_table('venda_item')
+    op.drop_table('venda')
+    op.drop_table('item')
+    op.drop_table('categoria')
+    op.drop_table('usuario')
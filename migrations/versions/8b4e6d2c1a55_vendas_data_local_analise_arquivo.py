@@ -0,0 +1,197 @@
+"""data_local/hora_local, versão e chave das vendas; análise, arquivo e alterações
+
+Acrescenta em venda as colunas data_local, hora_local, versao e
+chave_idempotencia com o índice (data_local, hora_local), o índice de
+venda_item.item_id e as tabelas marcador, item_analise, alteracao,
+venda_arquivo, venda_item_arquivo e resumo_arquivo. Por fim preenche
+data_local/hora_local das vendas existentes.
+
+Revision ID: 8b4e6d2c1a55
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+from datetime import timezone
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2c1a55'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+TZ_BR = ZoneInfo("America/Sao_Paulo")
+
+# vendas lidas e atualizadas por vez no preenchimento de data_local
+LOTE = 1000
+
+
+def _recriar():
+    # no SQLite as tabelas são recriadas para ganhar AUTOINCREMENT (ids nunca
+    # reaproveitados); no Postgres as alterações saem como ALTER TABLE
+    return "always" if op.get_bind().dialect.name == "sqlite" else "auto"
+
+
+def upgrade():
+    with op.batch_alter_table(
+        'venda', recreate=_recriar(), table_kwargs={"sqlite_autoincrement": True}
+    ) as batch_op:
+        batch_op.add_column(sa.Column('data_local', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('hora_local', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('chave_idempotencia', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('versao', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_unique_constraint('venda_chave_idempotencia_key', ['chave_idempotencia'])
+    op.create_index('ix_venda_data_local_hora_local', 'venda', ['data_local', 'hora_local'])
+
+    with op.batch_alter_table(
+        'venda_item', recreate=_recriar(), table_kwargs={"sqlite_autoincrement": True}
+    ) as batch_op:
+        batch_op.create_index('ix_venda_item_item_id', ['item_id'])
+
+    op.create_table(
+        'marcador',
+        sa.Column('chave', sa.String(length=50), nullable=False),
+        sa.Column('valor', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('chave')
+    )
+    op.create_table(
+        'item_analise',
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('linhas', sa.Integer(), nullable=False),
+        sa.Column('quantidade', sa.Float(), nullable=False),
+        sa.Column('receita', sa.Float(), nullable=False),
+        sa.Column('desconto', sa.Float(), nullable=False),
+        sa.Column('acrescimo', sa.Float(), nullable=False),
+        sa.Column('lucro', sa.Float(), nullable=False),
+        sa.Column('primeira_venda', sa.DateTime(), nullable=True),
+        sa.Column('ultima_venda', sa.DateTime(), nullable=True),
+        sa.Column('classe_abc', sa.String(length=1), nullable=False),
+        sa.Column('participacao_acumulada', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['item.id']),
+        sa.PrimaryKeyConstraint('item_id')
+    )
+    op.create_table(
+        'alteracao',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sequencia', sa.Integer(), nullable=True),
+        sa.Column('tabela', sa.String(length=30), nullable=False),
+        sa.Column('registro_id', sa.Integer(), nullable=False),
+        sa.Column('operacao', sa.String(length=6), nullable=False),
+        sa.Column('dados', sa.JSON(), nullable=True),
+        sa.Column('criado_em', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sequencia'),
+        sqlite_autoincrement=True
+    )
+    op.create_index('ix_alteracao_criado_em', 'alteracao', ['criado_em'])
+    op.create_table(
+        'venda_arquivo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('forma_pagamento', sa.String(length=50), nullable=False),
+        sa.Column('data_venda', sa.DateTime(), nullable=True),
+        sa.Column('data_local', sa.Date(), nullable=True),
+        sa.Column('hora_local', sa.Integer(), nullable=True),
+        sa.Column('valor_total', sa.Float(), nullable=False),
+        sa.Column('lucro_total', sa.Float(), nullable=False),
+        sa.Column('conferido', sa.Boolean(), nullable=False),
+        sa.Column('chave_idempotencia', sa.String(length=64), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chave_idempotencia')
+    )
+    op.create_index('ix_venda_arquivo_data_local', 'venda_arquivo', ['data_local'])
+    op.create_table(
+        'venda_item_arquivo',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('venda_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('quantidade', sa.Integer(), nullable=False),
+        sa.Column('valor_venda', sa.Float(), nullable=False),
+        sa.Column('desconto', sa.Float(), nullable=True),
+        sa.Column('acrescimo', sa.Float(), nullable=True),
+        sa.Column('lucro', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['item.id']),
+        sa.ForeignKeyConstraint(['venda_id'], ['venda_arquivo.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_venda_item_arquivo_venda_id', 'venda_item_arquivo', ['venda_id'])
+    op.create_table(
+        'resumo_arquivo',
+        sa.Column('data', sa.Date(), nullable=False),
+        sa.Column('forma_pagamento', sa.String(length=50), nullable=False),
+        sa.Column('quantidade_vendas', sa.Integer(), nullable=False),
+        sa.Column('valor_total', sa.Float(), nullable=False),
+        sa.Column('lucro_total', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('data', 'forma_pagamento')
+    )
+
+    preencher_data_local()
+
+
+def preencher_data_local():
+    """Calcula data_local/hora_local das vendas antigas a partir de data_venda (UTC).
+
+    SQL direto, sem os modelos: não incrementa versao nem gera registros em
+    alteracao, já que os dados da venda não mudam.
+    """
+    venda = sa.table(
+        'venda',
+        sa.column('id', sa.Integer),
+        sa.column('data_venda', sa.DateTime),
+        sa.column('data_local', sa.Date),
+        sa.column('hora_local', sa.Integer)
+    )
+    atualizar = (
+        venda.update()
+        .where(venda.c.id == sa.bindparam('b_id'))
+        .values(data_local=sa.bindparam('b_data_local'), hora_local=sa.bindparam('b_hora_local'))
+    )
+    conexao = op.get_bind()
+    ultimo_id = 0
+    while True:
+        linhas = conexao.execute(
+            sa.select(venda.c.id, venda.c.data_venda)
+            .where(
+                venda.c.id > ultimo_id,
+                venda.c.data_local.is_(None),
+                venda.c.data_venda.is_not(None)
+            )
+            .order_by(venda.c.id)
+            .limit(LOTE)
+        ).all()
+        if not linhas:
+            break
+        valores = []
+        for venda_id, data_venda in linhas:
+            if data_venda.tzinfo is None:
+                data_venda = data_venda.replace(tzinfo=timezone.utc)
+            local = data_venda.astimezone(TZ_BR)
+            valores.append({"b_id": venda_id, "b_data_local": local.date(), "b_hora_local": local.hour})
+        conexao.execute(atualizar, valores)
+        ultimo_id = linhas[-1][0]
+
+
+def downgrade():
+    op.drop_table('resumo_arquivo')
+    op.drop_index('ix_venda_item_arquivo_venda_id', table_name='venda_item_arquivo')
+    op.drop_table('venda_item_arquivo')
+    op.drop_index('ix_venda_arquivo_data_local', table_name='venda_arquivo')
+    op.drop_table('venda_arquivo')
+    op.drop_index('ix_alteracao_criado_em', table_name='alteracao')
+    op.drop_table('alteracao')
+    op.drop_table('item_analise')
+    op.drop_table('marcador')
+
+    with op.batch_alter_table('venda_item') as batch_op:
+        batch_op.drop_index('ix_venda_item_item_id')
+
+    op.drop_index('ix_venda_data_local_hora_local', table_name='venda')
+    with op.batch_alter_table('venda') as batch_op:
+        batch_op.drop_constraint('venda_chave_idempotencia_key', type_='unique')
+        batch_op.drop_column('versao')
+        batch_op.drop_column('chave_idempotencia')
+        batch_op.drop_column('hora_local')
+        batch_op.drop_column('data_local')